@@ -0,0 +1,144 @@
+"""Benchmarks Artimix's hot endpoints offline, against the fake Spotify API in fake_spotify.py.
+
+Run from the repository root: python -m benchmarks.bench_endpoints [--latency-ms 30 --throttle-rate 0.02 ...]
+
+Each scenario runs its requests through Flask's test client and reports latency percentiles,
+Spotify calls by spotipy method, 429s injected and the peak memory traced while it ran. The
+first run of a scenario starts from an empty cache, so it is reported separately. Latencies
+include tracemalloc's overhead; compare runs with each other, not with production numbers.
+"""
+import argparse
+import math
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+
+os.environ.setdefault("ARTIMIX_CACHE_DB", os.path.join(tempfile.mkdtemp(prefix="artimix-bench-"), "cache.sqlite3")) # Never touch the real cache
+
+import main
+from benchmarks.fake_spotify import FakeCatalog, FakeSpotify, FakeSpotifyAPI, load_recorded
+
+USER = {"id": "benchmark-user", "name": "Benchmark User", "image": None}
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def _expect(response, status, what):
+    if response.status_code != status:
+        raise RuntimeError(f"{what}: expected HTTP {status}, got {response.status_code}: {response.get_data(as_text=True)[:200]}")
+    return response
+
+
+def generate_preview(client, catalog, run, options):
+    """Submits a mix of `--mix-artists` artists and polls the job until the preview is stored."""
+    form = {"playlist_name": f"Benchmark {run}", "playlist_length": str(options.playlist_length)}
+    for slot in range(options.mix_artists):
+        artist = catalog.artist_at(slot)
+        form[f"artist_{slot + 1}"] = artist['name']
+        form[f"percentage_{slot + 1}"] = str(100 // options.mix_artists)
+        if slot: form[f"artist_id_{slot + 1}"] = artist['id'] # The first artist is resolved by search
+    job = _expect(client.post("/generate_preview", data=form, headers={"Accept": "application/json"}), 202, "generate_preview").get_json()
+    while True:
+        status = _expect(client.get(job['status_url']), 200, "preview job status").get_json()
+        if status['status'] == "done": return
+        if status['status'] == "failed": raise RuntimeError(f"preview job failed: {status['error']}")
+        time.sleep(0.005)
+
+
+def suggest_artists(client, catalog, run, options):
+    """Types an artist's name one key at a time, as the autocomplete box does."""
+    name = catalog.artist_at(run)['name']
+    for length in range(1, len(name) + 1):
+        _expect(client.get("/suggest_artists", query_string={"query": name[:length]}), 200, "suggest_artists")
+
+
+def liked_artists(client, catalog, run, options):
+    _expect(client.get("/liked_artists"), 200, "liked_artists")
+
+
+def confirm_add_to_spotify(client, catalog, run, options):
+    """Writes a stored preview of `--playlist-length` tracks to a new playlist."""
+    track_uris = [catalog.tracks[track_id]['uri'] for track_id in list(catalog.tracks)[run::max(1, len(catalog.tracks) // options.playlist_length)]]
+    preview_id = f"benchmark-{run}"
+    main.preview_store.save(preview_id, {"playlist_name": f"Benchmark {run}", "track_uris": track_uris[:options.playlist_length],
+                                         "artist_contributions": [], "total_songs_in_playlist": options.playlist_length})
+    response = _expect(client.post("/confirm_add_to_spotify", data={"preview_id": preview_id}), 200, "confirm_add_to_spotify")
+    if b"Playlist Created" not in response.data: raise RuntimeError("confirm_add_to_spotify: playlist was not created")
+
+
+SCENARIOS = {"suggest_artists": suggest_artists, "generate_preview": generate_preview,
+             "liked_artists": liked_artists, "confirm_add_to_spotify": confirm_add_to_spotify}
+
+
+def run_scenario(name, client, api, catalog, options):
+    calls_before = Counter(api.calls); throttled_before = sum(api.throttled.values())
+    retries_before = main.spotify_client_stats['retries']
+    latencies = []
+    tracemalloc.start()
+    for run in range(options.runs):
+        started = time.perf_counter()
+        SCENARIOS[name](client, catalog, run, options)
+        latencies.append(time.perf_counter() - started)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    calls = Counter(api.calls); calls.subtract(calls_before)
+    return {"latencies": latencies, "calls": +calls, "throttled": sum(api.throttled.values()) - throttled_before,
+            "retries": main.spotify_client_stats['retries'] - retries_before, "peak": peak}
+
+
+def report(name, result, runs):
+    latencies = result['latencies']; ms = lambda seconds: f"{seconds * 1000:.0f}ms"
+    warm = latencies[1:] or latencies
+    print(f"\n{name}: {runs} runs, first {ms(latencies[0])}, then p50 {ms(percentile(warm, 0.5))} "
+          f"p90 {ms(percentile(warm, 0.9))} p99 {ms(percentile(warm, 0.99))} max {ms(max(warm))}")
+    print(f"  spotify calls: {sum(result['calls'].values())} ({', '.join(f'{method} {count}' for method, count in result['calls'].most_common()) or 'none'})")
+    print(f"  429s injected: {result['throttled']}, retries: {result['retries']}, peak traced memory: {result['peak'] / 1024 / 1024:.1f}MB")
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("scenarios", nargs="*", help=f"Scenarios to run: {', '.join(SCENARIOS)} (default: all)")
+    parser.add_argument("--runs", type=int, default=5, help="Runs per scenario")
+    parser.add_argument("--latency-ms", type=float, default=30, help="Base latency of every fake Spotify call")
+    parser.add_argument("--jitter-ms", type=float, default=20, help="Random extra latency per call")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Share of calls answered with 429")
+    parser.add_argument("--retry-after", type=float, default=0.5, help="Retry-After seconds sent with injected 429s")
+    parser.add_argument("--artists", type=int, default=60, help="Artists in the synthetic catalog")
+    parser.add_argument("--albums", type=int, default=40, help="Releases per artist")
+    parser.add_argument("--tracks", type=int, default=12, help="Tracks per album")
+    parser.add_argument("--liked", type=int, default=2000, help="Saved tracks of the benchmark user")
+    parser.add_argument("--mix-artists", type=int, default=3, help="Artists per generated mix")
+    parser.add_argument("--playlist-length", type=int, default=200, help="Tracks per generated or written playlist")
+    parser.add_argument("--recorded", help="JSON file of recorded responses to replay, keyed by \"METHOD path\"")
+    options = parser.parse_args(argv)
+    unknown = [name for name in options.scenarios if name not in SCENARIOS]
+    if unknown: parser.error(f"unknown scenario: {', '.join(unknown)}")
+    return options
+
+
+def main_benchmark(argv):
+    options = parse_args(argv)
+    catalog = FakeCatalog(options.artists, options.albums, options.tracks, options.liked)
+    api = FakeSpotifyAPI(catalog, latency=options.latency_ms / 1000, jitter=options.jitter_ms / 1000, throttle_rate=options.throttle_rate,
+                         retry_after=options.retry_after, recorded=load_recorded(options.recorded) if options.recorded else None)
+    main.make_spotify_client = lambda access_token=None, user_id=None: FakeSpotify(api)
+    main.app.secret_key = main.app.secret_key or "benchmark"
+    client = main.app.test_client()
+    token_info = {"access_token": "benchmark-token", "refresh_token": "benchmark-refresh", "expires_at": time.time() + 24 * 60 * 60}
+    with client.session_transaction() as session:
+        session['sid'] = main.session_store.create(token_info, USER)
+    print(f"catalog: {len(catalog.artists)} artists, {len(catalog.albums)} releases, {len(catalog.tracks)} tracks, "
+          f"{len(catalog.liked_track_ids)} saved; latency {options.latency_ms:.0f}+{options.jitter_ms:.0f}ms, "
+          f"429 rate {options.throttle_rate:.0%}, limiter {main.SPOTIFY_REQUESTS_PER_SECOND:g} req/s")
+    for name in options.scenarios or SCENARIOS:
+        report(name, run_scenario(name, client, api, catalog, options), options.runs)
+
+
+if __name__ == "__main__":
+    main_benchmark(sys.argv[1:])
@@ -0,0 +1,81 @@
+"""Compares the memory held by candidate pools as plain dicts versus interned Track records.
+
+Run from the repository root: python -m benchmarks.bench_memory [artists] [albums] [tracks_per_album]
+"""
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+os.environ.setdefault("ARTIMIX_CACHE_DB", ":memory:") # Never touch the real cache
+
+import main
+
+
+def cached_albums(artists, albums, tracks_per_album):
+    """Yields (album, encoded track summaries) the way the catalog cache stores them."""
+    for a in range(artists):
+        for b in range(albums):
+            album = {'id': f"{a:02d}album{b:016d}", 'name': f"Album {b}",
+                     'images': [{'url': f"https://i.scdn.co/image/ab67616d0000b273{a:04d}{b:020d}"}]}
+            featured = {'id': f"{(a + 1) % artists:02d}artist{0:014d}", 'name': f"Featured Artist {(a + 1) % artists}"}
+            tracks = [{'uri': f"spotify:track:{a:02d}{b:04d}{t:016d}", 'name': f"Song {b}-{t}",
+                       'artists': [{'id': f"{a:02d}artist{0:014d}", 'name': f"Artist Number {a}"}] + ([featured] if t % 4 == 0 else []),
+                       'external_ids': {'isrc': f"US{a:03d}{b:03d}{t:05d}"}}
+                      for t in range(tracks_per_album)]
+            yield album, json.dumps([main._track_summary(track, album) for track in tracks])
+
+
+def dict_pools(encoded_albums):
+    """The previous representation: every decoded summary kept as its own dict."""
+    pools = {}
+    for album, encoded in encoded_albums:
+        for summary in json.loads(encoded):
+            summary['artists_str'] = ", ".join(summary.pop('artist_names'))
+            del summary['album_id']
+            pools.setdefault(summary['artist_ids'][0], []).append(summary)
+    return pools
+
+
+def record_pools(encoded_albums):
+    interner = main.RecordInterner(); pools = {}
+    for album, encoded in encoded_albums:
+        album_record = interner.album(album['id'], album['name'], main._image_url(album))
+        for summary in json.loads(encoded):
+            track = interner.track(summary, album_record)
+            pools.setdefault(track.artists[0].id, []).append(track)
+    return pools
+
+
+def measure(build, encoded_albums):
+    gc.collect()
+    objects_before = len(gc.get_objects())
+    tracemalloc.start()
+    started = time.perf_counter()
+    pools = build(encoded_albums)
+    elapsed = time.perf_counter() - started
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    tracked = len(gc.get_objects()) - objects_before
+    tracks = sum(len(pool) for pool in pools.values())
+    del pools
+    return {'tracks': tracks, 'retained': retained, 'peak': peak, 'gc_objects': tracked, 'seconds': elapsed}
+
+
+def main_benchmark(argv):
+    artists, albums, tracks_per_album = (int(arg) for arg in (argv + ["10", "60", "12"][len(argv):]))
+    encoded_albums = list(cached_albums(artists, albums, tracks_per_album))
+    results = {"dicts": measure(dict_pools, encoded_albums), "records": measure(record_pools, encoded_albums)}
+    print(f"{artists} artists x {albums} albums x {tracks_per_album} tracks")
+    print(f"{'':8} {'tracks':>7} {'retained':>12} {'peak':>12} {'per track':>10} {'gc objects':>11} {'seconds':>8}")
+    for name, result in results.items():
+        print(f"{name:8} {result['tracks']:>7} {result['retained'] / 1024:>10.0f}KB {result['peak'] / 1024:>10.0f}KB "
+              f"{result['retained'] / result['tracks']:>9.0f}B {result['gc_objects']:>11} {result['seconds']:>8.3f}")
+    saved = 1 - results['records']['retained'] / results['dicts']['retained']
+    print(f"records retain {saved:.0%} less memory than dicts")
+
+
+if __name__ == "__main__":
+    main_benchmark(sys.argv[1:])
@@ -0,0 +1,208 @@
+"""A local stand-in for the Spotify Web API, so Artimix's hot paths can be measured offline.
+
+FakeSpotify is a real RateLimitedSpotify whose HTTP transport is replaced: spotipy builds each
+request as usual and the rate limiter, concurrency limit and 429 retries all run, but the response
+comes from a synthetic FakeCatalog (or from recorded responses) after a configurable latency.
+"""
+import json
+import random
+import re
+import string
+import threading
+import time
+from collections import Counter
+from urllib.parse import parse_qsl
+
+import spotipy
+
+import main
+
+_BASE62 = string.digits + string.ascii_letters
+_WORDS = ("velvet", "neon", "paper", "silver", "midnight", "glass", "echo", "honey", "static", "wild", "golden", "hollow",
+          "crystal", "violet", "northern", "electric", "quiet", "broken", "summer", "ocean", "radio", "lunar", "copper", "ghost")
+_NOUNS = ("tigers", "harbor", "lights", "machines", "garden", "parade", "sisters", "engine", "canyon", "choir", "kids", "atlas")
+
+
+class FakeCatalog:
+    """A deterministic synthetic catalog: artists, their discographies, and one user's saved tracks."""
+
+    def __init__(self, artists=60, albums_per_artist=40, tracks_per_album=12, liked_tracks=2000, seed=0):
+        rng = random.Random(seed)
+        new_id = lambda: "".join(rng.choice(_BASE62) for _ in range(22))
+        self.artists = {}; self.albums = {}; self.tracks = {}; self.albums_by_artist = {}
+        combos = [f"{word.title()} {noun.title()}" for word in _WORDS for noun in _NOUNS]; rng.shuffle(combos)
+        for i in range(artists):
+            name = combos[i % len(combos)] + (f" {i // len(combos) + 1}" if i >= len(combos) else "")
+            artist_id = new_id()
+            self.artists[artist_id] = {"id": artist_id, "name": name, "uri": f"spotify:artist:{artist_id}", "genres": [],
+                                       "popularity": rng.randint(10, 90), "images": [{"url": f"https://i.scdn.co/image/{new_id()}"}]}
+        artist_ids = list(self.artists)
+        for artist_id in artist_ids:
+            self.albums_by_artist[artist_id] = []
+            for number in range(albums_per_artist):
+                album_id = new_id()
+                group = ("album", "single", "single", "compilation", "appears_on")[number % 5]
+                guest = self.artists[rng.choice(artist_ids)]
+                album_tracks = []
+                for position in range(tracks_per_album if group != "single" else 2):
+                    track_id = new_id()
+                    credits = [self.artists[artist_id]] + ([guest] if position % 5 == 4 and guest['id'] != artist_id else [])
+                    self.tracks[track_id] = {"id": track_id, "uri": f"spotify:track:{track_id}", "name": f"Song {number}-{position}",
+                                             "track_number": position + 1, "duration_ms": rng.randint(120000, 360000),
+                                             "artists": [{"id": a['id'], "name": a['name'], "uri": a['uri']} for a in credits],
+                                             "external_ids": {"isrc": f"QZ{rng.randint(0, 10 ** 10):010d}"},
+                                             "popularity": rng.randint(0, 100), "album_id": album_id}
+                    album_tracks.append(track_id)
+                self.albums[album_id] = {"id": album_id, "name": f"{self.artists[artist_id]['name']} Record {number}",
+                                         "uri": f"spotify:album:{album_id}", "album_group": group, "album_type": "compilation" if group == "compilation" else group,
+                                         "release_date": f"{1990 + number % 35}-01-01", "total_tracks": len(album_tracks),
+                                         "images": [{"url": f"https://i.scdn.co/image/{new_id()}"}], "track_ids": album_tracks}
+                self.albums_by_artist[artist_id].append(album_id)
+        all_tracks = list(self.tracks)
+        self.liked_track_ids = rng.sample(all_tracks, min(liked_tracks, len(all_tracks)))
+
+    def artist_at(self, index):
+        return list(self.artists.values())[index % len(self.artists)]
+
+    def simple_album(self, album_id):
+        return {key: value for key, value in self.albums[album_id].items() if key != 'track_ids'}
+
+    def simple_track(self, track_id):
+        return {key: value for key, value in self.tracks[track_id].items() if key not in ('album_id', 'external_ids', 'popularity')}
+
+    def full_track(self, track_id):
+        track = {key: value for key, value in self.tracks[track_id].items() if key != 'album_id'}
+        album = self.albums[self.tracks[track_id]['album_id']]
+        track['album'] = {key: album[key] for key in ('id', 'name', 'uri', 'album_type', 'release_date', 'images')}
+        return track
+
+
+def _page(items, limit, offset, total=None):
+    total = len(items) if total is None else total
+    limit = int(limit or 20); offset = int(offset or 0)
+    return {"items": items[offset:offset + limit], "total": total, "limit": limit, "offset": offset,
+            "next": "fake-next" if offset + limit < total else None}
+
+
+def load_recorded(path):
+    """Reads recorded responses: a JSON object of {"METHOD path": response}."""
+    with open(path) as f:
+        return json.load(f)
+
+
+class FakeSpotifyAPI:
+    """Answers spotipy requests from a FakeCatalog, counting calls and injecting latency and 429s.
+
+    `recorded` maps "METHOD path" (path as spotipy requests it, e.g. "GET artists/<id>") to a
+    response that is replayed instead of the synthetic one.
+    """
+
+    def __init__(self, catalog, latency=0.03, jitter=0.02, throttle_rate=0.0, retry_after=0.5, recorded=None, seed=0):
+        self.catalog = catalog; self.latency = latency; self.jitter = jitter
+        self.throttle_rate = throttle_rate; self.retry_after = retry_after; self.recorded = recorded or {}
+        self.calls = Counter(); self.throttled = Counter()
+        self._rng = random.Random(seed); self._lock = threading.Lock()
+        self._routes = [(re.compile(pattern), handler) for pattern, handler in (
+            (r"GET search$", self.search),
+            (r"GET artists/?$", self.artists),
+            (r"GET artists/([^/]+)$", self.artist),
+            (r"GET artists/([^/]+)/albums$", self.artist_albums),
+            (r"GET artists/([^/]+)/top-tracks$", self.artist_top_tracks),
+            (r"GET artists/([^/]+)/related-artists$", self.artist_related_artists),
+            (r"GET albums/?$", self.albums),
+            (r"GET albums/([^/]+)/tracks/?$", self.album_tracks),
+            (r"GET tracks/?$", self.tracks),
+            (r"GET me/?$", self.current_user),
+            (r"GET me/tracks$", self.current_user_saved_tracks),
+            (r"POST users/([^/]+)/playlists$", self.user_playlist_create),
+            (r"POST playlists/([^/]+)/(?:items|tracks)$", self.playlist_add_items))]
+
+    def handle(self, method, url, payload, params):
+        path, _, query = url.partition("?")
+        params = {**dict(parse_qsl(query)), **{key: value for key, value in params.items() if value is not None}}
+        for pattern, handler in self._routes:
+            match = pattern.match(f"{method} {path}")
+            if match: break
+        else:
+            raise spotipy.SpotifyException(404, -1, f"{method} {url}: not faked")
+        with self._lock:
+            self.calls[handler.__name__] += 1
+            throttle = self._rng.random() < self.throttle_rate
+            delay = self.latency + self._rng.uniform(0, self.jitter)
+        time.sleep(delay)
+        if throttle:
+            with self._lock: self.throttled[handler.__name__] += 1
+            raise spotipy.SpotifyException(429, -1, f"{method} {url}: API rate limit exceeded", headers={"Retry-After": str(self.retry_after)})
+        if f"{method} {path}" in self.recorded:
+            return self.recorded[f"{method} {path}"]
+        return handler(*match.groups(), payload=payload, **params)
+
+    def search(self, q, type="artist", limit=10, offset=0, **_):
+        term = q.split(":", 1)[-1].strip('"').lower()
+        found = [artist for artist in self.catalog.artists.values() if term in artist['name'].lower()]
+        return {"artists": _page(found, limit, offset)}
+
+    def artist(self, artist_id, **_):
+        return self.catalog.artists[artist_id]
+
+    def artists(self, ids, **_):
+        return {"artists": [self.catalog.artists.get(artist_id) for artist_id in ids.split(",")]}
+
+    def artist_albums(self, artist_id, include_groups=None, limit=20, offset=0, **_):
+        groups = set((include_groups or "album,single").split(","))
+        albums = [self.catalog.simple_album(album_id) for album_id in self.catalog.albums_by_artist.get(artist_id, [])
+                  if self.catalog.albums[album_id]['album_group'] in groups]
+        return _page(albums, limit, offset)
+
+    def artist_top_tracks(self, artist_id, **_):
+        album_ids = self.catalog.albums_by_artist.get(artist_id, [])[:10]
+        return {"tracks": [self.catalog.full_track(self.catalog.albums[album_id]['track_ids'][0]) for album_id in album_ids]}
+
+    def artist_related_artists(self, artist_id, **_):
+        artist_ids = list(self.catalog.artists)
+        start = artist_ids.index(artist_id) + 1 if artist_id in self.catalog.artists else 0
+        return {"artists": [self.catalog.artists[other] for other in (artist_ids[start:] + artist_ids[:start])[:20]]}
+
+    def albums(self, ids, **_):
+        albums = []
+        for album_id in ids.split(","):
+            album = self.catalog.simple_album(album_id)
+            album['tracks'] = _page([self.catalog.simple_track(track_id) for track_id in self.catalog.albums[album_id]['track_ids']],
+                                    main.ALBUM_TRACKS_PAGE_SIZE, 0)
+            albums.append(album)
+        return {"albums": albums}
+
+    def album_tracks(self, album_id, limit=50, offset=0, **_):
+        return _page([self.catalog.simple_track(track_id) for track_id in self.catalog.albums[album_id]['track_ids']], limit, offset)
+
+    def tracks(self, ids, **_):
+        return {"tracks": [self.catalog.full_track(track_id) if track_id in self.catalog.tracks else None for track_id in ids.split(",")]}
+
+    def current_user(self, **_):
+        return {"id": "benchmark-user", "display_name": "Benchmark User", "images": []}
+
+    def current_user_saved_tracks(self, limit=20, offset=0, **_):
+        liked = self.catalog.liked_track_ids
+        items = [{"added_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(1700000000 + len(liked) - position)), # Newest first
+                  "track": self.catalog.full_track(track_id)} for position, track_id in enumerate(liked)]
+        return _page(items, limit, offset)
+
+    def user_playlist_create(self, user_id, payload=None, **_):
+        playlist_id = f"fakeplaylist{self.calls['user_playlist_create']}"
+        return {"id": playlist_id, "name": (payload or {}).get('name'), "external_urls": {"spotify": f"https://open.spotify.com/playlist/{playlist_id}"}}
+
+    def playlist_add_items(self, playlist_id, payload=None, **_):
+        return {"snapshot_id": f"snapshot-{len(payload or [])}"}
+
+
+class _FakeTransport(spotipy.Spotify):
+    def _internal_call(self, method, url, payload, params):
+        return self.api.handle(method, url, payload, params)
+
+
+class FakeSpotify(main.RateLimitedSpotify, _FakeTransport):
+    """A RateLimitedSpotify that talks to a FakeSpotifyAPI instead of the network."""
+
+    def __init__(self, api):
+        super().__init__(auth="benchmark-token")
+        self.api = api
@@ -1,12 +1,29 @@
 import os
 import random
 import json # For AJAX responses AND file storage
-import uuid # For generating unique IDs for preview files
-from flask import Flask, render_template, request, redirect, session, url_for, jsonify
+import uuid # For generating unique preview IDs
+import zlib # Compresses stored previews
+import heapq
+import functools
+import bisect
+import math
+import re
+import unicodedata
+import sys # sys.intern for shared record strings
+from collections import Counter, OrderedDict
+from flask import Flask, Response, g, has_request_context, render_template, request, redirect, session, stream_with_context, url_for, jsonify
 from dotenv import load_dotenv
 import spotipy
 from spotipy.oauth2 import SpotifyOAuth
+from spotipy.cache_handler import MemoryCacheHandler
 import datetime 
+import sqlite3 # Shared on-disk cache for Spotify catalog data
+import threading
+import time
+import click
+import requests
+import urllib3
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 from urllib.parse import urlparse # Added for robust URL parsing
 
 # Load environment variables
@@ -21,38 +38,1422 @@ SPOTIFY_CLIENT_SECRET = os.getenv("SPOTIFY_CLIENT_SECRET")
 SPOTIPY_REDIRECT_URI = os.getenv("SPOTIPY_REDIRECT_URI")
 SCOPE = "playlist-modify-public playlist-modify-private user-read-private user-read-email user-library-read"
 
-# Directory for temporary preview files
-TEMP_PREVIEW_DIR = 'temp_previews'
-if not os.path.exists(TEMP_PREVIEW_DIR):
-    os.makedirs(TEMP_PREVIEW_DIR)
+# On-disk cache for artist discographies (shared by all users and workers)
+CACHE_DB_PATH = os.getenv("ARTIMIX_CACHE_DB", "artimix_cache.sqlite3")
+CATALOG_CACHE_MAX_ENTRIES = int(os.getenv("ARTIMIX_CATALOG_CACHE_MAX_ENTRIES", "200000"))
+EVICTION_CHECK_INTERVAL = 100
+ARTIST_ALBUMS_TTL = 24 * 60 * 60      # Album lists change when an artist releases something
+ALBUM_TRACKS_TTL = 30 * 24 * 60 * 60  # Album tracklists practically never change
+TOP_TRACKS_TTL = 6 * 60 * 60          # Top tracks drift daily
+TRACK_DETAILS_TTL = 30 * 24 * 60 * 60
+
+# Concurrency for the preview fetch pipeline
+MAX_CONCURRENT_SPOTIFY_CALLS = int(os.getenv("ARTIMIX_MAX_CONCURRENT_SPOTIFY_CALLS", "8"))
+PREVIEW_FETCH_DEADLINE_SECONDS = float(os.getenv("ARTIMIX_PREVIEW_FETCH_DEADLINE", "20"))
+SPOTIFY_REQUESTS_PER_SECOND = float(os.getenv("ARTIMIX_SPOTIFY_REQUESTS_PER_SECOND", "10"))
+SPOTIFY_REQUESTS_BURST = 20
+SPOTIFY_MAX_RETRIES = 4
+SPOTIFY_MAX_RETRY_AFTER_SECONDS = 10 # Longer Retry-Afters (Spotify sometimes sends hours) fail calls at once instead of blocking threads
+SPOTIFY_REQUEST_TIMEOUT_SECONDS = 10
+ALBUMS_BATCH_SIZE = 20 # Spotify's maximum number of IDs for GET /albums
+TRACKS_BATCH_SIZE = 50 # Spotify's maximum number of IDs for GET /tracks
+PREVIEW_TRACKS_PAGE_SIZE = 50
+ARTIST_ALBUMS_PAGE_SIZE = 50
+ALBUM_TRACKS_PAGE_SIZE = 50
+DISCOGRAPHY_ALBUM_GROUPS = "album,single,compilation,appears_on"
+ALBUM_GROUP_PRIORITY = {'album': 0, 'single': 1, 'compilation': 2, 'appears_on': 3}
+ARTISTS_BATCH_SIZE = 50 # Spotify's maximum number of IDs for GET /artists
+ARTIST_DETAILS_TTL = 7 * 24 * 60 * 60
+
+# Preview storage
+PREVIEW_TTL_SECONDS = int(os.getenv("ARTIMIX_PREVIEW_TTL", str(24 * 60 * 60)))
+PREVIEW_MAX_BYTES = 2 * 1024 * 1024                                           # Per preview, compressed
+PREVIEW_STORE_MAX_BYTES = int(os.getenv("ARTIMIX_PREVIEW_STORE_MAX_BYTES", str(256 * 1024 * 1024)))
+PREVIEW_MEMORY_ENTRIES = 256
+PREVIEW_SWEEP_INTERVAL_SECONDS = 10 * 60
+
+# Artist autocomplete
+SUGGESTION_LIMIT = 5
+SUGGESTION_CACHE_TTL_SECONDS = 5 * 60
+SUGGESTION_CACHE_MAX_ENTRIES = 5000
+SUGGESTION_BACKSPACE_REUSE_CHARS = 3 # How much shorter a query may be than a cached one and still reuse it
+
+ARTIST_INDEX_MIN_SCORE = 0.6 # Share of the query's trigrams a name must contain to count as a local match
+
+# Mix selection
+DEFAULT_PLAYLIST_LENGTH = 50
+MAX_PLAYLIST_LENGTH = 1000
+TOP_TRACK_WEIGHT = 2.0 # Top tracks are twice as likely to be picked as album cuts
+
+# Artist similarity graph and "mix around an artist"
+ARTIST_RELATED_TTL = 30 * 24 * 60 * 60 # Related artists change slowly
+RELATED_ARTISTS_LIMIT = 20             # Spotify returns up to 20 related artists
+COCREDIT_FULL_STRENGTH = 3             # Saved songs two artists share before their link counts fully
+GRAPH_HOP_DECAY = 0.6                  # Score kept per hop away from the seed artist
+MIX_AROUND_DEFAULT_NEIGHBORS = 5
+MIX_AROUND_MAX_NEIGHBORS = 20
+MIX_AROUND_MAX_HOPS = 3
+
+PLAYLIST_ADD_BATCH_SIZE = 100 # Spotify's maximum number of items per playlist_add_items call
+
+# Background preview generation
+PREVIEW_JOB_WORKERS = int(os.getenv("ARTIMIX_PREVIEW_JOB_WORKERS", "4"))
+PREVIEW_JOB_RETENTION_SECONDS = 60 * 60
+
+# Batch mix generation (JSON API and CLI)
+BATCH_MIX_WORKERS = int(os.getenv("ARTIMIX_BATCH_MIX_WORKERS", "4")) # Separate from the preview workers so batches never queue ahead of users
+MAX_BATCH_MIXES = 500
+
+# Liked-songs library index
+LIBRARY_SYNC_INTERVAL_SECONDS = int(os.getenv("ARTIMIX_LIBRARY_SYNC_INTERVAL", "60"))
+
+# Login sessions (stored server-side; the cookie only holds a session ID)
+SESSION_TTL_SECONDS = int(os.getenv("ARTIMIX_SESSION_TTL", str(30 * 24 * 60 * 60)))
+SESSION_MEMORY_ENTRIES = 10000
+TOKEN_REFRESH_MARGIN_SECONDS = 5 * 60 # Refresh in the background once a token has less than this left
+TOKEN_MIN_VALID_SECONDS = 60          # Below this, requests wait for the refresh instead
+SESSION_RECHECK_SECONDS = 30          # How long a worker trusts its cached session before re-reading it (logouts elsewhere)
+
+# Instrumentation
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0) # Seconds
+SERVER_TIMING_HEADER = os.getenv("ARTIMIX_SERVER_TIMING", "False").lower() == "true"  # Per-request Spotify timings for browser devtools
+METRICS_TOKEN = os.getenv("ARTIMIX_METRICS_TOKEN") # If set, /metrics requires "Authorization: Bearer <token>"
 
 # --- Context Processor ---
 @app.context_processor
 def inject_current_year():
     return {'current_year': datetime.datetime.now().year}
 
+# --- Persistent Cache ---
+_db_conn = None
+_db_lock = threading.RLock()
+
+def get_db():
+    """Returns the process-wide SQLite connection, creating it on first use."""
+    global _db_conn
+    with _db_lock:
+        if _db_conn is None:
+            _db_conn = sqlite3.connect(CACHE_DB_PATH, check_same_thread=False, timeout=10)
+            _db_conn.execute("PRAGMA journal_mode=WAL")
+            _db_conn.execute("PRAGMA synchronous=NORMAL")
+        return _db_conn
+
+def ensure_schema(*statements):
+    """Runs CREATE ... IF NOT EXISTS statements in one transaction."""
+    with _db_lock:
+        conn = get_db()
+        with conn:
+            for statement in statements:
+                conn.execute(statement)
+
+def ensure_column(table, column, definition):
+    """Adds a column that tables created by an older version lack."""
+    with _db_lock:
+        conn = get_db()
+        if column not in [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]:
+            with conn: conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+class SQLiteCache:
+    """Key/value cache stored in SQLite with per-entry TTLs and LRU eviction."""
+
+    def __init__(self, table, max_entries):
+        self.table = table
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lookups = Counter() # (key kind, "hit" or "miss") -> count
+        self.evictions = 0
+        self._writes_since_size_check = EVICTION_CHECK_INTERVAL # Check on the first write
+        ensure_schema(f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                      "expires_at REAL NOT NULL, last_access REAL NOT NULL)",
+                      f"CREATE INDEX IF NOT EXISTS {table}_last_access ON {table} (last_access)")
+
+    def get(self, key):
+        now = time.time()
+        with _db_lock:
+            conn = get_db()
+            row = conn.execute(f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)).fetchone()
+            if row is None or row[1] <= now:
+                self.misses += 1; self.lookups[(_cache_key_kind(key), "miss")] += 1
+                if row is not None:
+                    with conn: conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                return None
+            with conn: conn.execute(f"UPDATE {self.table} SET last_access = ? WHERE key = ?", (now, key))
+            self.hits += 1; self.lookups[(_cache_key_kind(key), "hit")] += 1
+        return json.loads(row[0])
+
+    def get_many(self, keys):
+        """Looks up several keys in one query; returns {key: value} for the fresh ones."""
+        if not keys: return {}
+        now = time.time(); found = {}
+        with _db_lock:
+            conn = get_db()
+            for i in range(0, len(keys), 500): # Stay under SQLite's bound-parameter limit
+                chunk = keys[i:i + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = conn.execute(f"SELECT key, value FROM {self.table} WHERE key IN ({placeholders}) AND expires_at > ?",
+                                    (*chunk, now)).fetchall()
+                found.update((key, json.loads(value)) for key, value in rows)
+            if found:
+                with conn: conn.executemany(f"UPDATE {self.table} SET last_access = ? WHERE key = ?", [(now, k) for k in found])
+            self.hits += len(found); self.misses += len(keys) - len(found)
+            self.lookups.update((_cache_key_kind(key), "hit" if key in found else "miss") for key in keys)
+        return found
+
+    def set(self, key, value, ttl):
+        self.set_many({key: value}, ttl)
+
+    def set_many(self, items, ttl):
+        """Stores several {key: value} entries in one transaction."""
+        now = time.time()
+        rows = [(key, json.dumps(value, separators=(',', ':')), now + ttl, now) for key, value in items.items()]
+        with _db_lock:
+            conn = get_db()
+            with conn:
+                conn.executemany(f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at, last_access) VALUES (?, ?, ?, ?)", rows)
+                self._writes_since_size_check += len(rows)
+                if self._writes_since_size_check < EVICTION_CHECK_INTERVAL: return
+                # Counting rows is a table scan, so the size bound is enforced every few writes
+                self._writes_since_size_check = 0
+                overflow = conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0] - self.max_entries
+                if overflow > 0:
+                    # Expired entries go first, then the least recently used ones
+                    conn.execute(f"DELETE FROM {self.table} WHERE key IN (SELECT key FROM {self.table} "
+                                 "ORDER BY expires_at > ?, last_access LIMIT ?)", (now, overflow))
+                    self.evictions += overflow
+
+    def delete(self, *keys):
+        if not keys: return
+        with _db_lock:
+            conn = get_db()
+            with conn:
+                conn.executemany(f"DELETE FROM {self.table} WHERE key = ?", [(k,) for k in keys])
+
+    def stats(self):
+        with _db_lock:
+            size = get_db().execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {"entries": size, "max_entries": self.max_entries, "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "hit_ratio": (self.hits / lookups) if lookups else 0.0}
+
+def _cache_key_kind(key):
+    return key.split(":", 1)[0]
+
+# Keys: "albums:<artist_id>", "album:<album_id>", "top:<artist_id>", "artist:<artist_id>", "track:<track_id>"
+catalog_cache = SQLiteCache("catalog_cache", CATALOG_CACHE_MAX_ENTRIES)
+
+def invalidate_artist_cache(artist_id):
+    """Drops everything cached for one artist, including the albums it was listed with."""
+    albums = catalog_cache.get(f"albums:{artist_id}") or []
+    catalog_cache.delete(f"albums:{artist_id}", f"top:{artist_id}", *[f"album:{album['id']}" for album in albums])
+
+@app.cli.command("invalidate-artist")
+@click.argument("artist_id")
+def invalidate_artist_command(artist_id):
+    """Removes one artist's cached discography."""
+    invalidate_artist_cache(artist_id)
+    click.echo(f"Invalidated cached discography for {artist_id}")
+
+# --- Preview Store ---
+class PreviewTooLargeError(Exception):
+    pass
+
+class SQLitePreviewBackend:
+    """Stores previews as zlib-compressed compact JSON blobs in SQLite."""
+
+    def __init__(self, table="previews"):
+        self.table = table
+        ensure_schema(f"CREATE TABLE IF NOT EXISTS {table} (id TEXT PRIMARY KEY, payload BLOB NOT NULL, "
+                      "size INTEGER NOT NULL, created_at REAL NOT NULL, expires_at REAL NOT NULL)",
+                      f"CREATE INDEX IF NOT EXISTS {table}_expires_at ON {table} (expires_at)")
+
+    def put(self, preview_id, payload, expires_at, max_total_bytes):
+        """Writes one preview atomically, dropping the oldest ones if the store would exceed max_total_bytes."""
+        with _db_lock:
+            conn = get_db()
+            with conn:
+                conn.execute(f"INSERT OR REPLACE INTO {self.table} (id, payload, size, created_at, expires_at) VALUES (?, ?, ?, ?, ?)",
+                             (preview_id, payload, len(payload), time.time(), expires_at))
+                total = conn.execute(f"SELECT COALESCE(SUM(size), 0) FROM {self.table}").fetchone()[0]
+                evicted = []
+                if total > max_total_bytes:
+                    for old_id, size in conn.execute(f"SELECT id, size FROM {self.table} WHERE id != ? ORDER BY created_at", (preview_id,)):
+                        evicted.append(old_id); total -= size
+                        if total <= max_total_bytes: break
+                    conn.executemany(f"DELETE FROM {self.table} WHERE id = ?", [(old_id,) for old_id in evicted])
+        return evicted
+
+    def get(self, preview_id):
+        with _db_lock:
+            return get_db().execute(f"SELECT payload, expires_at FROM {self.table} WHERE id = ? AND expires_at > ?",
+                                    (preview_id, time.time())).fetchone()
+
+    def delete(self, preview_id):
+        with _db_lock:
+            conn = get_db()
+            with conn: conn.execute(f"DELETE FROM {self.table} WHERE id = ?", (preview_id,))
+
+    def sweep(self):
+        """Deletes expired previews and returns how many were removed."""
+        with _db_lock:
+            conn = get_db()
+            with conn: return conn.execute(f"DELETE FROM {self.table} WHERE expires_at <= ?", (time.time(),)).rowcount
+
+class PreviewStore:
+    """Expiring preview storage: an in-process LRU in front of a compact persistent backend.
+
+    Loaded previews are shared with the LRU, so callers change them only through save().
+    """
+
+    def __init__(self, backend, ttl, max_bytes, max_total_bytes, memory_entries):
+        self.backend = backend
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_total_bytes = max_total_bytes
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict() # preview_id -> (expires_at, data)
+        self._lock = threading.Lock()
+        self._sweeper = None
+
+    def save(self, preview_id, data):
+        payload = zlib.compress(json.dumps(data, separators=(',', ':')).encode("utf-8"))
+        if len(payload) > self.max_bytes:
+            raise PreviewTooLargeError(f"Preview is {len(payload)} bytes; the limit is {self.max_bytes}.")
+        expires_at = time.time() + self.ttl
+        evicted = self.backend.put(preview_id, payload, expires_at, self.max_total_bytes)
+        with self._lock:
+            for old_id in evicted: self._memory.pop(old_id, None)
+            self._remember(preview_id, expires_at, data)
+        self._ensure_sweeper()
+
+    def load(self, preview_id, fresh=False):
+        """Returns the preview data, or None if it does not exist or has expired.
+
+        `fresh` skips the in-process copy, for reads that must see saves made by other workers.
+        """
+        with self._lock:
+            entry = None if fresh else self._memory.get(preview_id)
+            if entry and entry[0] > time.time():
+                self._memory.move_to_end(preview_id)
+                return entry[1]
+        row = self.backend.get(preview_id)
+        if row is None:
+            return None
+        data = json.loads(zlib.decompress(row[0]))
+        with self._lock: self._remember(preview_id, row[1], data)
+        return data
+
+    def delete(self, preview_id):
+        with self._lock: self._memory.pop(preview_id, None)
+        self.backend.delete(preview_id)
+
+    def sweep(self):
+        now = time.time()
+        with self._lock:
+            for preview_id in [pid for pid, (expires_at, _) in self._memory.items() if expires_at <= now]:
+                del self._memory[preview_id]
+        return self.backend.sweep()
+
+    def _remember(self, preview_id, expires_at, data):
+        self._memory[preview_id] = (expires_at, data)
+        self._memory.move_to_end(preview_id)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _ensure_sweeper(self):
+        if self._sweeper is not None: return
+        with self._lock:
+            if self._sweeper is not None: return
+            self._sweeper = threading.Thread(target=self._sweep_forever, name="artimix-preview-sweeper", daemon=True)
+            self._sweeper.start()
+
+    def _sweep_forever(self):
+        while True:
+            time.sleep(PREVIEW_SWEEP_INTERVAL_SECONDS)
+            try:
+                self.sweep()
+            except sqlite3.Error as e:
+                print(f"DEBUG: preview sweeper - Error sweeping expired previews: {e}")
+
+preview_store = PreviewStore(SQLitePreviewBackend(), ttl=PREVIEW_TTL_SECONDS, max_bytes=PREVIEW_MAX_BYTES,
+                             max_total_bytes=PREVIEW_STORE_MAX_BYTES, memory_entries=PREVIEW_MEMORY_ENTRIES)
+
+# --- Autocomplete Cache ---
+class SingleFlight:
+    """Lets concurrent callers asking for the same key share one in-flight computation."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        with self._lock:
+            future = self._calls.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = self._calls[key] = Future()
+        if not is_leader:
+            return future.result()
+        try:
+            result = fn()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock: del self._calls[key]
+
+class SuggestionCache:
+    """In-memory TTL/LRU cache of artist suggestions keyed by normalized query.
+
+    Text queries can also be answered from related cached queries: a shorter query typed
+    while backspacing reuses a slightly longer cached one, and a longer query reuses a
+    cached prefix when that prefix's results still fill a whole suggestion list.
+    """
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict() # key -> (expires_at, suggestions)
+        self._truncations = {}        # shortened text key -> set of cached text keys it was cut from
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            suggestions = self._get_fresh(key)
+            if suggestions is not None: self.hits += 1
+            else: self.misses += 1
+            return suggestions
+
+    def set(self, key, suggestions):
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, suggestions)
+            self._entries.move_to_end(key)
+            if key.startswith("text:"):
+                for cut in range(1, SUGGESTION_BACKSPACE_REUSE_CHARS + 1):
+                    if len(key) - cut > len("text:"):
+                        self._truncations.setdefault(key[:-cut], set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._forget(next(iter(self._entries)))
+
+    def get_from_related(self, text):
+        """Answers a normalized text query from cached neighbouring queries, or returns None."""
+        key = f"text:{text}"
+        with self._lock:
+            for longer_key in sorted(self._truncations.get(key, ()), key=len):
+                suggestions = self._get_fresh(longer_key)
+                matches = [item for item in suggestions or [] if item['name'].lower().startswith(text)]
+                if matches:
+                    self.hits += 1
+                    return matches
+            for end in range(len(text) - 1, 0, -1):
+                suggestions = self._get_fresh(f"text:{text[:end]}")
+                matches = [item for item in suggestions or [] if text in item['name'].lower()]
+                if len(matches) >= SUGGESTION_LIMIT:
+                    self.hits += 1
+                    return matches
+        return None
+
+    def _get_fresh(self, key):
+        entry = self._entries.get(key)
+        if entry is None: return None
+        if entry[0] <= time.time():
+            self._forget(key); return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def _forget(self, key):
+        self._entries.pop(key, None)
+        for cut in range(1, SUGGESTION_BACKSPACE_REUSE_CHARS + 1):
+            cached_keys = self._truncations.get(key[:-cut])
+            if cached_keys is not None:
+                cached_keys.discard(key)
+                if not cached_keys: del self._truncations[key[:-cut]]
+
+suggestion_cache = SuggestionCache(SUGGESTION_CACHE_TTL_SECONDS, SUGGESTION_CACHE_MAX_ENTRIES)
+suggestion_flights = SingleFlight()
+
+# --- Local Artist Index ---
+def normalize_artist_name(name):
+    """Lowercases, strips accents and collapses whitespace so 'Beyoncé ' matches 'beyonce'."""
+    decomposed = unicodedata.normalize("NFKD", name.lower())
+    return " ".join("".join(c for c in decomposed if not unicodedata.combining(c)).split())
+
+def _word_trigrams(text, complete_words=True):
+    # Words are padded at the front so short prefixes ("ra") still produce trigrams; only complete
+    # names get an end marker, so a query that is still being typed matches any continuation.
+    trigrams = set()
+    for word in text.split():
+        padded = f"  {word} " if complete_words else f"  {word}"
+        trigrams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return trigrams
+
+class ArtistIndex:
+    """Searchable trigram index of every artist we have resolved, persisted in SQLite.
+
+    Lookups are fuzzy (a few typos still match) and ranked by match quality, then by
+    Spotify popularity and how often the artist has come up here.
+    """
+
+    def __init__(self):
+        self._artists = {}  # artist_id -> {"id", "name", "image_url", "popularity", "seen", "normalized"}
+        self._trigrams = {} # trigram -> set of artist ids
+        self._by_name = {}  # normalized name -> set of artist ids
+        self._lock = threading.Lock()
+        ensure_schema("CREATE TABLE IF NOT EXISTS artist_index (id TEXT PRIMARY KEY, name TEXT NOT NULL, image_url TEXT, "
+                      "popularity INTEGER, seen INTEGER NOT NULL DEFAULT 1)")
+        with _db_lock:
+            rows = get_db().execute("SELECT id, name, image_url, popularity, seen FROM artist_index").fetchall()
+        with self._lock:
+            for artist_id, name, image_url, popularity, seen in rows:
+                self._index(artist_id, name, image_url, popularity, seen)
+
+    def add_many(self, artist_items):
+        """Records artists from any Spotify artist object (or our {"id", "name", "image_url"} dicts)."""
+        rows = []
+        with self._lock:
+            for item in artist_items:
+                if not item or not item.get('id') or not item.get('name'): continue
+                image_url = item['image_url'] if 'image_url' in item else (item['images'][0]['url'] if item.get('images') else None)
+                known = self._artists.get(item['id'])
+                popularity = item.get('popularity', known['popularity'] if known else None)
+                image_url = image_url or (known['image_url'] if known else None)
+                seen = known['seen'] + 1 if known else 1
+                self._index(item['id'], item['name'], image_url, popularity, seen)
+                rows.append((item['id'], item['name'], image_url, popularity, seen))
+        if rows:
+            with _db_lock:
+                conn = get_db()
+                with conn:
+                    conn.executemany("INSERT OR REPLACE INTO artist_index (id, name, image_url, popularity, seen) VALUES (?, ?, ?, ?, ?)", rows)
+
+    def search(self, query, limit):
+        """Returns up to `limit` suggestion dicts for a partially typed artist name."""
+        normalized_query = normalize_artist_name(query)
+        query_trigrams = _word_trigrams(normalized_query, complete_words=False)
+        if not query_trigrams: return []
+        with self._lock:
+            overlap = {}
+            for trigram in query_trigrams:
+                for artist_id in self._trigrams.get(trigram, ()):
+                    overlap[artist_id] = overlap.get(artist_id, 0) + 1
+            scored = []
+            for artist_id, shared in overlap.items():
+                score = shared / len(query_trigrams)
+                if score < ARTIST_INDEX_MIN_SCORE: continue
+                artist = self._artists[artist_id]
+                if artist['normalized'].startswith(normalized_query): score += 0.5
+                score += 0.3 * (artist['popularity'] or 0) / 100 + 0.05 * math.log1p(artist['seen'])
+                scored.append((score, artist))
+            scored.sort(key=lambda pair: (pair[0], -len(pair[1]['normalized'])), reverse=True)
+            return [{"id": artist['id'], "name": artist['name'], "image_url": artist['image_url']} for _, artist in scored[:limit]]
+
+    def has_exact_name(self, query):
+        normalized_query = normalize_artist_name(query)
+        with self._lock:
+            return bool(self._by_name.get(normalized_query))
+
+    def all_prefix_matches(self, suggestions, query):
+        """Whether every suggestion's name starts with the query, i.e. none is only a fuzzy match."""
+        normalized_query = normalize_artist_name(query)
+        with self._lock:
+            return all(self._artists[s['id']]['normalized'].startswith(normalized_query) for s in suggestions if s['id'] in self._artists)
+
+    def _index(self, artist_id, name, image_url, popularity, seen):
+        previous = self._artists.get(artist_id)
+        normalized = normalize_artist_name(name)
+        if previous and previous['normalized'] != normalized:
+            for trigram in _word_trigrams(previous['normalized']):
+                self._trigrams.get(trigram, set()).discard(artist_id)
+            self._by_name.get(previous['normalized'], set()).discard(artist_id)
+        self._artists[artist_id] = {"id": artist_id, "name": name, "image_url": image_url,
+                                    "popularity": popularity, "seen": seen, "normalized": normalized}
+        for trigram in _word_trigrams(normalized):
+            self._trigrams.setdefault(trigram, set()).add(artist_id)
+        self._by_name.setdefault(normalized, set()).add(artist_id)
+
+artist_index = ArtistIndex()
+
+# --- Records ---
+class Artist:
+    __slots__ = ('id', 'name')
+
+    def __init__(self, artist_id, name):
+        self.id = artist_id; self.name = name
+
+class Album:
+    __slots__ = ('id', 'name', 'image_url')
+
+    def __init__(self, album_id, name, image_url):
+        self.id = album_id; self.name = name; self.image_url = image_url
+
+class Track:
+    """A candidate or saved track. Artists and album are shared references handed out by a RecordInterner."""
+    __slots__ = ('uri', 'name', 'artists', 'album', 'isrc', 'weight')
+
+    def __init__(self, uri, name, artists, album, isrc=None, weight=1.0):
+        self.uri = uri; self.name = name; self.artists = artists; self.album = album; self.isrc = isrc; self.weight = weight
+
+    @property
+    def id(self):
+        return _track_id(self.uri)
+
+    @property
+    def artist_ids(self):
+        return tuple(artist.id for artist in self.artists)
+
+    @property
+    def artists_str(self):
+        return ", ".join(artist.name for artist in self.artists)
+
+    @property
+    def image_url(self):
+        return self.album.image_url
+
+    def to_liked_song(self):
+        return {"id": self.id, "name": self.name, "artists": [artist.name for artist in self.artists],
+                "uri": self.uri, "album": self.album.name, "image_url": self.album.image_url}
+
+class RecordInterner:
+    """Hands out one Artist, Album and credit tuple per ID, so the tracks of a request share them.
+
+    Strings kept on shared records are interned. Lookups are safe from several crawler threads;
+    a race only costs a duplicate record, never a wrong one.
+    """
+    def __init__(self):
+        self.artists = {}; self.albums = {}; self.credits = {}
+
+    def artist(self, artist_id, name):
+        artist = self.artists.get(artist_id)
+        if artist is None:
+            artist = self.artists.setdefault(artist_id, Artist(sys.intern(artist_id), sys.intern(name)))
+        return artist
+
+    def credit(self, artist_ids, names):
+        """Returns the shared tuple of Artists for one credit line (most tracks of an artist share theirs)."""
+        key = tuple(artist_ids)
+        artists = self.credits.get(key)
+        if artists is None:
+            artists = self.credits.setdefault(key, tuple(self.artist(artist_id, name) for artist_id, name in zip(artist_ids, names)))
+        return artists
+
+    def album(self, album_id, name, image_url):
+        key = album_id or image_url # Entries cached before album IDs were stored only share by image
+        album = self.albums.get(key)
+        if album is None:
+            album = self.albums.setdefault(key, Album(album_id and sys.intern(album_id), name and sys.intern(name),
+                                                      image_url and sys.intern(image_url)))
+        elif name and not album.name:
+            album.name = sys.intern(name)
+        return album
+
+    def track(self, summary, album=None):
+        """Builds a Track from a cached track summary (see _track_summary)."""
+        artists = self.credit(summary['artist_ids'], summary.get('artist_names') or summary['artists_str'].split(", "))
+        if album is None: album = self.album(summary.get('album_id'), None, summary.get('image_url'))
+        return Track(summary['uri'], summary['name'], artists, album, summary.get('isrc'), summary.get('weight', 1.0))
+
+    def liked_track(self, song):
+        """Builds a Track from a stored liked-library payload (see _liked_item_record)."""
+        return Track(song['uri'], song['name'], self.credit(song['artist_ids'], song['artists']), self.album(song.get('album_id'), song['album'], song['image_url']))
+
+# --- Liked Library Index ---
+ensure_schema("CREATE TABLE IF NOT EXISTS liked_tracks (user_id TEXT NOT NULL, track_id TEXT NOT NULL, "
+              "added_at TEXT NOT NULL, payload TEXT NOT NULL, PRIMARY KEY (user_id, track_id))",
+              "CREATE INDEX IF NOT EXISTS liked_tracks_added_at ON liked_tracks (user_id, added_at DESC)",
+              "CREATE TABLE IF NOT EXISTS liked_sync (user_id TEXT PRIMARY KEY, synced_at REAL NOT NULL, skipped INTEGER NOT NULL DEFAULT 0)")
+ensure_column("liked_sync", "skipped", "INTEGER NOT NULL DEFAULT 0") # Saved items without a track ID, which Spotify counts in its total
+ensure_column("liked_sync", "newest_added_at", "TEXT") # Newest added_at seen, so skipped items above it are counted only once
+
+_library_sync_locks = {}
+_library_sync_locks_guard = threading.Lock()
+
+def _liked_item_record(item):
+    track = item['track']
+    return track['id'], item['added_at'], {
+        "id": track['id'],
+        "name": track['name'],
+        "artists": [artist['name'] for artist in track['artists']],
+        "artist_ids": [artist['id'] for artist in track['artists']],
+        "uri": track['uri'],
+        "album": track['album']['name'],
+        "album_id": track['album'].get('id'),
+        "image_url": track['album']['images'][0]['url'] if track['album']['images'] else None
+    }
+
+def _sync_liked_library_pages(sp, user_id, force=False):
+    """Brings the stored copy of a user's saved tracks up to date, yielding each page of new songs.
+
+    Saved tracks come back newest first, so paging stops at the first track we already hold with
+    the same added_at. Skipped local/unavailable items have nothing to match, so an incremental pass
+only counts those added after the newest item of the last sync. If the stored count plus the skipped items then disagrees
+    with Spotify's total (tracks were removed), the library is re-read in full. Returns True if the library was re-read in full.
+    """
+    with _library_sync_locks_guard:
+        user_lock = _library_sync_locks.setdefault(user_id, threading.Lock())
+    with user_lock:
+        conn = get_db()
+        with _db_lock:
+            row = conn.execute("SELECT synced_at, skipped, newest_added_at FROM liked_sync WHERE user_id = ?", (user_id,)).fetchone()
+        if row and not force and time.time() - row[0] < LIBRARY_SYNC_INTERVAL_SECONDS:
+            return False
+        full_resync = row is None
+        while True:
+            limit = 50; offset = 0; total = 0; seen_track_ids = set(); skipped = 0
+            last_newest = "" if full_resync else (row[2] or ""); newest = last_newest
+            while True:
+                results = sp.current_user_saved_tracks(limit=limit, offset=offset)
+                items = results.get('items', []); total = results.get('total', 0)
+                page_records = []; reached_known = False
+                for item in items:
+                    added_at = item.get('added_at') or ""
+                    if not item.get('track') or not item['track'].get('id'): # Local or unavailable tracks
+                        if added_at > last_newest: skipped += 1
+                        newest = max(newest, added_at); continue
+                    newest = max(newest, added_at)
+                    record = _liked_item_record(item)
+                    if not full_resync:
+                        with _db_lock:
+                            known = conn.execute("SELECT 1 FROM liked_tracks WHERE user_id = ? AND track_id = ? AND added_at = ?",
+                                                 (user_id, record[0], record[1])).fetchone()
+                        if known: reached_known = True; break
+                    page_records.append(record)
+                # Pages are stored as they arrive so memory stays bounded by one page
+                with _db_lock:
+                    with conn:
+                        conn.executemany("INSERT OR REPLACE INTO liked_tracks (user_id, track_id, added_at, payload) VALUES (?, ?, ?, ?)",
+                                         [(user_id, track_id, added_at, json.dumps(song, separators=(',', ':')))
+                                          for track_id, added_at, song in page_records])
+                artist_graph.add_cocredits([song for _, _, song in page_records])
+                if full_resync: seen_track_ids.update(record[0] for record in page_records)
+                if page_records: yield [song for _, _, song in page_records]
+                if reached_known or len(items) < limit: break
+                offset += limit
+            with _db_lock:
+                with conn:
+                    if full_resync:
+                        stored_ids = [track_id for (track_id,) in conn.execute("SELECT track_id FROM liked_tracks WHERE user_id = ?", (user_id,))]
+                        conn.executemany("DELETE FROM liked_tracks WHERE user_id = ? AND track_id = ?",
+                                         [(user_id, track_id) for track_id in stored_ids if track_id not in seen_track_ids])
+                    else:
+                        skipped += row[1] # New skipped items on top of those counted by the last sync
+                    stored = conn.execute("SELECT COUNT(*) FROM liked_tracks WHERE user_id = ?", (user_id,)).fetchone()[0]
+                    if full_resync or stored + skipped == total:
+                        conn.execute("INSERT OR REPLACE INTO liked_sync (user_id, synced_at, skipped, newest_added_at) VALUES (?, ?, ?, ?)",
+                                     (user_id, time.time(), skipped, newest))
+            if full_resync or stored + skipped == total: return full_resync
+            full_resync = True
+
+def sync_liked_library(sp, user_id, force=False):
+    """Brings the stored copy of a user's saved tracks up to date."""
+    for _ in _sync_liked_library_pages(sp, user_id, force=force): pass
+
+def get_liked_library(user_id, interner=None):
+    """Returns the stored saved tracks for a user as Track records, newest first."""
+    interner = interner or RecordInterner()
+    with _db_lock:
+        rows = get_db().execute("SELECT payload FROM liked_tracks WHERE user_id = ? ORDER BY added_at DESC, track_id DESC", (user_id,)).fetchall()
+    return [interner.liked_track(json.loads(row[0])) for row in rows]
+
+def _stored_liked_library_pages(user_id, page_size, interner):
+    """Yields the stored saved tracks newest first as Track records, one page per query."""
+    cursor = None
+    while True:
+        with _db_lock:
+            if cursor is None:
+                rows = get_db().execute("SELECT added_at, track_id, payload FROM liked_tracks WHERE user_id = ? "
+                                        "ORDER BY added_at DESC, track_id DESC LIMIT ?", (user_id, page_size)).fetchall()
+            else:
+                rows = get_db().execute("SELECT added_at, track_id, payload FROM liked_tracks WHERE user_id = ? "
+                                        "AND (added_at < ? OR (added_at = ? AND track_id < ?)) "
+                                        "ORDER BY added_at DESC, track_id DESC LIMIT ?",
+                                        (user_id, cursor[0], cursor[0], cursor[1], page_size)).fetchall()
+        if not rows: return
+        yield [interner.liked_track(json.loads(row[2])) for row in rows]
+        cursor = rows[-1][:2]
+
+def iter_liked_library_pages(sp, user_id, page_size=50, interner=None):
+    """Yields a user's saved tracks as Track records page by page: new ones as Spotify returns them, then the stored rest."""
+    interner = interner or RecordInterner()
+    streamed_ids = set() # Track ids only, so a resync never repeats a song already sent
+    sync_pages = _sync_liked_library_pages(sp, user_id)
+    while True:
+        try:
+            page = next(sync_pages)
+        except StopIteration as stop:
+            full_resync = stop.value
+            break
+        page = [interner.liked_track(song) for song in page if song['id'] not in streamed_ids]
+        streamed_ids.update(track.id for track in page)
+        if page: yield page
+    if full_resync: return
+    for page in _stored_liked_library_pages(user_id, page_size, interner):
+        page = [track for track in page if track.id not in streamed_ids]
+        if page: yield page
+
+def get_artist_images_cached(sp, artist_ids):
+    """Returns {artist_id: image_url}, fetching uncached artists in batches of ARTISTS_BATCH_SIZE."""
+    cached = catalog_cache.get_many([f"artist:{artist_id}" for artist_id in artist_ids])
+    images = {key[len("artist:"):]: details['image_url'] for key, details in cached.items()}
+    missing = [artist_id for artist_id in artist_ids if artist_id not in images]
+    for i in range(0, len(missing), ARTISTS_BATCH_SIZE):
+        batch_response = sp.artists(missing[i:i + ARTISTS_BATCH_SIZE])
+        artist_index.add_many(batch_response.get('artists', []))
+        for artist in batch_response.get('artists', []):
+            if not artist: continue
+            details = {"id": artist['id'], "name": artist['name'], "image_url": artist['images'][0]['url'] if artist.get('images') else None}
+            catalog_cache.set(f"artist:{artist['id']}", details, ARTIST_DETAILS_TTL)
+            images[artist['id']] = details['image_url']
+    return images
+
+def get_current_user_id(sp):
+    """Returns the logged-in user's Spotify ID."""
+    return current_session_user_id() or sp.current_user()['id']
+
+# --- Artist Graph ---
+def _combine_strengths(strengths):
+    """Merges independent edge strengths in [0, 1]: two weak links make a stronger one, never more than 1."""
+    missing = 1.0
+    for strength in strengths: missing *= 1.0 - strength
+    return 1.0 - missing
+
+class ArtistGraph:
+    """Artist-similarity graph stored in SQLite, grown as Artimix sees artists.
+
+    Edges come from Spotify's related artists (looked up once per artist per ARTIST_RELATED_TTL,
+    stronger for higher-ranked artists) and from saved songs credited to several artists. Edges
+    are used in both directions.
+    """
+
+    def __init__(self):
+        ensure_schema("CREATE TABLE IF NOT EXISTS artist_graph_nodes (artist_id TEXT PRIMARY KEY, name TEXT NOT NULL, related_fetched_at REAL)",
+                      "CREATE TABLE IF NOT EXISTS artist_related (source TEXT NOT NULL, target TEXT NOT NULL, rank INTEGER NOT NULL, "
+                      "PRIMARY KEY (source, target))",
+                      "CREATE INDEX IF NOT EXISTS artist_related_target ON artist_related (target)",
+                      "CREATE TABLE IF NOT EXISTS artist_cocredits (track_id TEXT NOT NULL, source TEXT NOT NULL, target TEXT NOT NULL, "
+                      "PRIMARY KEY (track_id, source, target))",
+                      "CREATE INDEX IF NOT EXISTS artist_cocredits_source ON artist_cocredits (source)",
+                      "CREATE INDEX IF NOT EXISTS artist_cocredits_target ON artist_cocredits (target)")
+
+    def add_related(self, artist_id, artist_items, artist_name=None):
+        """Replaces an artist's related-artist edges with Spotify's current list (best match first).
+
+        Without `artist_name` a new source node is stored nameless ('') until a name is known.
+        """
+        artist_items = [item for item in artist_items if item and item.get('id') and item['id'] != artist_id]
+        with _db_lock:
+            conn = get_db()
+            with conn:
+                conn.execute("DELETE FROM artist_related WHERE source = ?", (artist_id,))
+                conn.executemany("INSERT OR REPLACE INTO artist_related (source, target, rank) VALUES (?, ?, ?)",
+                                 [(artist_id, item['id'], rank) for rank, item in enumerate(artist_items)])
+                conn.executemany("INSERT INTO artist_graph_nodes (artist_id, name) VALUES (?, ?) "
+                                 "ON CONFLICT (artist_id) DO UPDATE SET name = excluded.name", [(item['id'], item['name']) for item in artist_items])
+                conn.execute("INSERT INTO artist_graph_nodes (artist_id, name, related_fetched_at) VALUES (?, ?, ?) "
+                             "ON CONFLICT (artist_id) DO UPDATE SET related_fetched_at = excluded.related_fetched_at, "
+                             "name = COALESCE(NULLIF(excluded.name, ''), name)", (artist_id, artist_name or "", time.time()))
+        catalog_cache.set_many({f"artist:{item['id']}": {"id": item['id'], "name": item['name'], "image_url": _image_url(item)}
+                                for item in artist_items}, ARTIST_DETAILS_TTL)
+
+    def add_cocredits(self, songs):
+        """Links the artists credited together on saved songs (liked-library payloads)."""
+        nodes = {}; edges = []
+        for song in songs:
+            credits = sorted(set(zip(song['artist_ids'], song['artists'])))
+            if len(credits) < 2: continue
+            nodes.update(credits)
+            edges += [(song['id'], source[0], target[0]) for i, source in enumerate(credits) for target in credits[i + 1:]]
+        if not edges: return
+        with _db_lock:
+            conn = get_db()
+            with conn:
+                conn.executemany("INSERT INTO artist_graph_nodes (artist_id, name) VALUES (?, ?) ON CONFLICT (artist_id) DO NOTHING", nodes.items())
+                conn.executemany("INSERT OR IGNORE INTO artist_cocredits (track_id, source, target) VALUES (?, ?, ?)", edges)
+
+    def related_artists(self, sp, artist_id):
+        """Returns related-artist details best first, from the graph or (once per TTL) from Spotify."""
+        with _db_lock:
+            row = get_db().execute("SELECT related_fetched_at FROM artist_graph_nodes WHERE artist_id = ?", (artist_id,)).fetchone()
+        if not (row and row[0] and time.time() - row[0] < ARTIST_RELATED_TTL):
+            self.fetch_related(sp, artist_id)
+        with _db_lock:
+            rows = get_db().execute("SELECT r.target, n.name FROM artist_related r JOIN artist_graph_nodes n ON n.artist_id = r.target "
+                                    "WHERE r.source = ? ORDER BY r.rank", (artist_id,)).fetchall()
+        return [self.details(target, name) for target, name in rows]
+
+    def fetch_related(self, sp, artist_id):
+        try:
+            related = (sp.artist_related_artists(artist_id) or {}).get('artists', [])
+        except spotipy.SpotifyException as e:
+            if is_rate_limited(e): raise
+            # Remembered as "no related artists" so an unavailable endpoint is not asked again until the TTL passes
+            print(f"DEBUG: artist graph - Could not fetch related artists for '{artist_id}': {e}")
+            related = []
+        artist_index.add_many(related)
+        source = get_artist_details_by_id(sp, artist_id) # Usually cached: the artist was just resolved
+        self.add_related(artist_id, related, source['name'] if source else None)
+
+    def details(self, artist_id, name=None):
+        """Cached artist details, else the name the graph holds ('' if it never learned one)."""
+        cached = catalog_cache.get(f"artist:{artist_id}")
+        if cached: return cached
+        if name is None:
+            with _db_lock:
+                row = get_db().execute("SELECT name FROM artist_graph_nodes WHERE artist_id = ?", (artist_id,)).fetchone()
+            name = row[0] if row and row[0] != artist_id else "" # Older versions stored the ID as a placeholder name
+        return {"id": artist_id, "name": name, "image_url": None}
+
+    def neighbors(self, artist_id):
+        """Returns {neighbor_id: strength in (0, 1]} over related-artist and co-credit edges, both directions."""
+        with _db_lock:
+            conn = get_db()
+            related = conn.execute("SELECT target, rank FROM artist_related WHERE source = ? "
+                                   "UNION ALL SELECT source, rank FROM artist_related WHERE target = ?", (artist_id, artist_id)).fetchall()
+            cocredits = conn.execute("SELECT CASE WHEN source = ? THEN target ELSE source END, COUNT(*) FROM artist_cocredits "
+                                     "WHERE source = ? OR target = ? GROUP BY 1", (artist_id, artist_id, artist_id)).fetchall()
+        strengths = {}
+        for neighbor, rank in related:
+            strengths.setdefault(neighbor, []).append(1.0 - rank / (2.0 * RELATED_ARTISTS_LIMIT))
+        for neighbor, count in cocredits:
+            strengths.setdefault(neighbor, []).append(min(1.0, count / COCREDIT_FULL_STRENGTH))
+        return {neighbor: _combine_strengths(values) for neighbor, values in strengths.items()}
+
+    def expand(self, sp, seed_id, neighbor_count, max_hops, deadline=None):
+        """Finds the `neighbor_count` artists closest to a seed by breadth-first search, hop by hop.
+
+        An artist's score is its best parent's score times the edge strength times
+        GRAPH_HOP_DECAY, so it falls with graph distance. Only the strongest artists of a hop are
+        expanded further, and the search stops early once no further hop could beat the current
+        picks. Related artists missing from the graph are looked up concurrently until `deadline`.
+        Returns (artist_id, score, distance) tuples, seed first.
+        """
+        scores = {seed_id: 1.0}; distances = {seed_id: 0}; frontier = [seed_id]
+        for hop in range(1, max_hops + 1):
+            self._ensure_related(sp, frontier, deadline)
+            reached = {}
+            for artist_id in frontier:
+                for neighbor, strength in self.neighbors(artist_id).items():
+                    if neighbor in distances: continue
+                    reached[neighbor] = max(reached.get(neighbor, 0.0), scores[artist_id] * strength * GRAPH_HOP_DECAY)
+            if not reached: break
+            scores.update(reached); distances.update((artist_id, hop) for artist_id in reached)
+            frontier = sorted(reached, key=reached.get, reverse=True)[:neighbor_count]
+            picks = sorted((score for artist_id, score in scores.items() if artist_id != seed_id), reverse=True)[:neighbor_count]
+            if len(picks) == neighbor_count and picks[-1] >= scores[frontier[0]] * GRAPH_HOP_DECAY: break
+            if _seconds_left(deadline) == 0: break
+        ranked = sorted((artist_id for artist_id in scores if artist_id != seed_id), key=lambda artist_id: (-scores[artist_id], distances[artist_id]))
+        return [(artist_id, scores[artist_id], distances[artist_id]) for artist_id in [seed_id] + ranked[:neighbor_count]]
+
+    def _ensure_related(self, sp, artist_ids, deadline):
+        if not artist_ids: return
+        with _db_lock:
+            placeholders = ",".join("?" * len(artist_ids))
+            fresh = {artist_id for (artist_id,) in get_db().execute(
+                f"SELECT artist_id FROM artist_graph_nodes WHERE artist_id IN ({placeholders}) AND related_fetched_at > ?",
+                (*artist_ids, time.time() - ARTIST_RELATED_TTL))}
+        futures = [artist_fetch_pool.submit(self.fetch_related, sp, artist_id) for artist_id in artist_ids if artist_id not in fresh]
+        wait(futures, timeout=_seconds_left(deadline))
+        for future in futures:
+            if future.done() and future.exception():
+                if is_rate_limited(future.exception()): raise future.exception()
+                print(f"DEBUG: artist graph - Error expanding the graph: {future.exception()}")
+
+artist_graph = ArtistGraph()
+
+@app.cli.command("build-artist-graph")
+def build_artist_graph_command():
+    """Links co-credited artists from every stored liked library (new saves are linked as they sync)."""
+    with _db_lock:
+        payloads = [row[0] for row in get_db().execute("SELECT payload FROM liked_tracks")]
+    for i in range(0, len(payloads), 1000):
+        artist_graph.add_cocredits([json.loads(payload) for payload in payloads[i:i + 1000]])
+    click.echo(f"Linked co-credited artists from {len(payloads)} saved songs")
+
+# --- Concurrent Fetching ---
+# Artist-level tasks wait on album-level tasks, so they run on separate pools to avoid starving each other.
+artist_fetch_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="artimix-artist")
+album_fetch_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="artimix-album")
+
+def _seconds_left(deadline):
+    return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+# --- Instrumentation ---
+def _prometheus_labels(names, values):
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for value in values)
+    return ",".join(f'{name}="{value}"' for name, value in zip(names, escaped))
+
+class LabeledCounter:
+    """Thread-safe counter with one series per label tuple, exported in Prometheus text format."""
+
+    def __init__(self, name, help_text, label_names):
+        self.name = name; self.help_text = help_text; self.label_names = label_names
+        self._values = Counter()
+        self._lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._values[labels] += amount
+
+    def prometheus_lines(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"] + \
+               [f"{self.name}{{{_prometheus_labels(self.label_names, labels)}}} {value}" for labels, value in values]
+
+class Histogram:
+    """Thread-safe latency histogram with one series per label tuple, exported in Prometheus text format."""
+
+    def __init__(self, name, help_text, label_names, buckets=LATENCY_BUCKETS):
+        self.name = name; self.help_text = help_text; self.label_names = label_names; self.buckets = buckets
+        self._series = {} # labels -> [count per bucket..., count above the last bucket, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, labels, seconds):
+        with self._lock:
+            series = self._series.setdefault(labels, [0] * (len(self.buckets) + 1) + [0.0, 0])
+            series[bisect.bisect_left(self.buckets, seconds)] += 1
+            series[-2] += seconds; series[-1] += 1
+
+    def prometheus_lines(self):
+        with self._lock:
+            all_series = sorted((labels, list(series)) for labels, series in self._series.items())
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, series in all_series:
+            label_text = _prometheus_labels(self.label_names, labels); cumulative = 0
+            for bound, count in zip([*map(str, self.buckets), "+Inf"], series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{label_text},le="{bound}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{label_text}}} {series[-2]:.6f}")
+            lines.append(f"{self.name}_count{{{label_text}}} {series[-1]}")
+        return lines
+
+class RequestTrace:
+    """Spotify time spent on behalf of one request, grouped by API route, for the Server-Timing header."""
+
+    def __init__(self):
+        self.calls = {} # call name -> (count, seconds)
+        self._lock = threading.Lock()
+
+    def add(self, call, seconds):
+        with self._lock:
+            count, total = self.calls.get(call, (0, 0.0))
+            self.calls[call] = (count + 1, total + seconds)
+
+    def totals(self):
+        """(calls, seconds) over every API route."""
+        with self._lock:
+            return sum(count for count, _ in self.calls.values()), sum(seconds for _, seconds in self.calls.values())
+
+    def server_timing(self, total_seconds):
+        with self._lock:
+            calls = sorted(self.calls.items(), key=lambda item: item[1][1], reverse=True)
+        entries = [f"total;dur={total_seconds * 1000:.1f}"]
+        if calls: # Calls overlap when fetched concurrently, so their sum can exceed the total
+            entries.append(f'spotify;dur={sum(seconds for _, (_, seconds) in calls) * 1000:.1f};desc="{sum(count for _, (count, _) in calls)} calls"')
+        entries += [f'spotify-{i};dur={seconds * 1000:.1f};desc="{call} x{count}"' for i, (call, (count, seconds)) in enumerate(calls)]
+        return ", ".join(entries)
+
+spotify_call_seconds = Histogram("artimix_spotify_call_seconds", "Spotify API calls by route endpoint and API route, including limiter waits and retries.",
+                                 ("endpoint", "call"))
+spotify_call_errors = LabeledCounter("artimix_spotify_call_errors_total", "Spotify API calls that failed after retries, by HTTP status.",
+                                     ("endpoint", "call", "status"))
+request_seconds = Histogram("artimix_request_seconds", "Time to serve each request, until the response body is fully sent.",
+                            ("endpoint", "method", "status"))
+
+_SPOTIFY_ID_PARENTS = {"artists", "albums", "tracks", "users", "playlists", "shows", "episodes"}
+
+def spotify_call_name(method, url):
+    """Names a Spotify request by its API route, e.g. "GET artists/{id}/albums", so calls can be grouped."""
+    segments = [segment for segment in url.split("?", 1)[0].split("/v1/", 1)[-1].split("/") if segment]
+    return " ".join([method, "/".join("{id}" if i and segments[i - 1] in _SPOTIFY_ID_PARENTS else segment
+                                      for i, segment in enumerate(segments))])
+
+@app.before_request
+def start_request_trace():
+    g.request_started = time.perf_counter()
+    g.trace = RequestTrace()
+
+@app.after_request
+def record_request_timing(response):
+    started = g.get('request_started')
+    if started is None: return response
+    labels = (request.endpoint or "unmatched", request.method, str(response.status_code))
+    if SERVER_TIMING_HEADER:
+        response.headers['Server-Timing'] = g.trace.server_timing(time.perf_counter() - started)
+    # Streamed responses are still being sent here, so the latency is recorded when the body is done
+    response.call_on_close(lambda: request_seconds.observe(labels, time.perf_counter() - started))
+    return response
+
+def render_metrics():
+    """Renders every counter and histogram in Prometheus text exposition format."""
+    lines = spotify_call_seconds.prometheus_lines() + spotify_call_errors.prometheus_lines() + request_seconds.prometheus_lines()
+    with _spotify_client_stats_lock:
+        client_stats = dict(spotify_client_stats)
+    for name, value in client_stats.items():
+        unit = "" if name.endswith("_seconds") else "_total"
+        lines += [f"# TYPE artimix_spotify_client_{name}{unit} counter", f"artimix_spotify_client_{name}{unit} {value}"]
+    catalog_stats = catalog_cache.stats()
+    lines += ["# HELP artimix_cache_lookups_total Cache lookups by cache, key kind and result.", "# TYPE artimix_cache_lookups_total counter"]
+    with _db_lock:
+        catalog_lookups = sorted(catalog_cache.lookups.items())
+    lines += [f"artimix_cache_lookups_total{{{_prometheus_labels(('cache', 'kind', 'result'), ('catalog', kind, result))}}} {count}"
+              for (kind, result), count in catalog_lookups]
+    lines += [f'artimix_cache_lookups_total{{cache="suggestions",kind="all",result="hit"}} {suggestion_cache.hits}',
+              f'artimix_cache_lookups_total{{cache="suggestions",kind="all",result="miss"}} {suggestion_cache.misses}']
+    suggestion_lookups = suggestion_cache.hits + suggestion_cache.misses
+    lines += ["# TYPE artimix_cache_hit_ratio gauge",
+              f'artimix_cache_hit_ratio{{cache="catalog"}} {catalog_stats["hit_ratio"]:.4f}',
+              f'artimix_cache_hit_ratio{{cache="suggestions"}} {(suggestion_cache.hits / suggestion_lookups) if suggestion_lookups else 0.0:.4f}',
+              "# TYPE artimix_cache_entries gauge", f'artimix_cache_entries{{cache="catalog"}} {catalog_stats["entries"]}',
+              "# TYPE artimix_cache_evictions_total counter", f'artimix_cache_evictions_total{{cache="catalog"}} {catalog_stats["evictions"]}']
+    return "\n".join(lines) + "\n"
+
+# --- Spotify Client ---
+class RateLimiterPaused(Exception):
+    """The limiter is paused for longer than the caller is willing to wait."""
+
+    def __init__(self, seconds):
+        super().__init__(f"Rate limiter paused for another {seconds:.0f}s")
+        self.seconds = seconds
+
+class TokenBucket:
+    """Thread-safe token bucket shared by every Spotify call in this process."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, max_pause=None):
+        """Blocks until a token is available; returns the seconds spent waiting.
+
+        Raises RateLimiterPaused instead of sleeping if the bucket is paused for more than `max_pause` seconds.
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._paused_until > now:
+                    delay = self._paused_until - now
+                    if max_pause is not None and delay > max_pause: raise RateLimiterPaused(delay)
+                elif self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                else:
+                    delay = (1 - self._tokens) / self.rate
+            time.sleep(delay); waited += delay
+
+    def pause(self, seconds):
+        """Stops handing out tokens for a while, e.g. after Spotify answers 429 with Retry-After."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+spotify_rate_limiter = TokenBucket(rate=SPOTIFY_REQUESTS_PER_SECOND, capacity=SPOTIFY_REQUESTS_BURST)
+_spotify_call_slots = threading.BoundedSemaphore(MAX_CONCURRENT_SPOTIFY_CALLS)
+spotify_client_stats = {"requests": 0, "throttled": 0, "retries": 0, "failures": 0,
+                        "limiter_wait_seconds": 0.0, "retry_wait_seconds": 0.0}
+_spotify_client_stats_lock = threading.Lock()
+
+def _count_spotify(**increments):
+    with _spotify_client_stats_lock:
+        for name, amount in increments.items():
+            spotify_client_stats[name] += amount
+
+# One keep-alive connection pool for every client; urllib3 retries are off because RateLimitedSpotify retries itself
+spotify_http_session = requests.Session()
+_spotify_http_adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=MAX_CONCURRENT_SPOTIFY_CALLS * 2, max_retries=0)
+spotify_http_session.mount("https://", _spotify_http_adapter)
+
+def is_rate_limited(error):
+    return isinstance(error, spotipy.SpotifyException) and error.http_status == 429
+
+class RateLimitedSpotify(spotipy.Spotify):
+    """spotipy client that shares the pooled session, the global rate limit and the concurrency limit.
+
+    429 responses pause the shared limiter for Retry-After seconds and are retried with jitter;
+    a Retry-After over SPOTIFY_MAX_RETRY_AFTER_SECONDS is raised at once, and so is every call
+    made while that pause lasts. For reads, 5xx responses, connection errors and timeouts are
+    retried with exponential backoff; writes are resent only if they never reached Spotify (see
+    _is_safe_to_resend). The final failure is raised to the caller.
+    Every call is timed against the route endpoint the client was created for, including calls
+    made later from worker threads on that request's behalf.
+    """
+
+    def __init__(self, auth=None, auth_manager=None):
+        super().__init__(auth=auth, auth_manager=auth_manager, requests_session=spotify_http_session,
+                         requests_timeout=SPOTIFY_REQUEST_TIMEOUT_SECONDS, retries=0, status_retries=0)
+        self.endpoint = (request.endpoint or "unmatched") if has_request_context() else "background"
+        self.trace = g.get('trace') if has_request_context() else None
+
+    def __del__(self):
+        pass # The pooled session outlives any single client, so spotipy must not close it
+
+    def _internal_call(self, method, url, payload, params):
+        call = spotify_call_name(method, url); started = time.perf_counter()
+        try:
+            return self._call_with_retries(method, url, payload, params)
+        except Exception as e:
+            spotify_call_errors.inc((self.endpoint, call, str(getattr(e, 'http_status', None) or type(e).__name__)))
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            spotify_call_seconds.observe((self.endpoint, call), elapsed)
+            if self.trace: self.trace.add(call, elapsed)
+
+    def _call_with_retries(self, method, url, payload, params):
+        for attempt in range(SPOTIFY_MAX_RETRIES + 1):
+            try:
+                waited = spotify_rate_limiter.acquire(max_pause=SPOTIFY_MAX_RETRY_AFTER_SECONDS)
+            except RateLimiterPaused as e:
+                _count_spotify(failures=1)
+                raise spotipy.SpotifyException(429, -1, f"{method} {url}: {e}", headers={"Retry-After": str(math.ceil(e.seconds))})
+            _count_spotify(requests=1, limiter_wait_seconds=waited)
+            try:
+                with _spotify_call_slots:
+                    # spotipy pops keys off params, so each attempt gets its own copy
+                    return super()._internal_call(method, url, payload, dict(params))
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                # The pooled adapter does no retries of its own, so resets and timeouts are retried here
+                if attempt == SPOTIFY_MAX_RETRIES or not _is_safe_to_resend(method, e):
+                    _count_spotify(failures=1)
+                    raise
+                delay = (2 ** attempt) * 0.5 * random.uniform(0.5, 1.5)
+            except spotipy.SpotifyException as e:
+                # 429s were never processed; a 5xx on a write may have been, so only reads retry those
+                if attempt == SPOTIFY_MAX_RETRIES or not (e.http_status == 429 or (e.http_status >= 500 and method == "GET")):
+                    _count_spotify(failures=1)
+                    raise
+                if e.http_status == 429:
+                    try:
+                        retry_after = float((e.headers or {}).get("Retry-After", 1))
+                    except ValueError:
+                        retry_after = 1.0
+                    spotify_rate_limiter.pause(retry_after)
+                    if retry_after > SPOTIFY_MAX_RETRY_AFTER_SECONDS: # Later calls fail fast in acquire() until the pause ends
+                        _count_spotify(throttled=1, failures=1)
+                        raise
+                    delay = retry_after + random.uniform(0, 0.5 + retry_after * 0.25)
+                    _count_spotify(throttled=1)
+                    print(f"DEBUG: spotify client - 429 on {method} {url}, retrying in {delay:.1f}s")
+                else:
+                    delay = (2 ** attempt) * 0.5 * random.uniform(0.5, 1.5)
+            _count_spotify(retries=1, retry_wait_seconds=delay)
+            time.sleep(delay)
+
+def _is_safe_to_resend(method, error):
+    """Whether a call that failed in transport can be sent again without risking a duplicate write.
+
+    Reads always can. Writes (creating a playlist, adding tracks) only if the connection was never
+    made; after a read timeout or reset Spotify may already have applied them, and write_playlist's
+    checkpoint is what resumes those.
+    """
+    if method == "GET" or isinstance(error, requests.exceptions.ConnectTimeout): return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(error, requests.exceptions.ConnectionError) and isinstance(reason, urllib3.exceptions.NewConnectionError)
+
+SPOTIFY_RATE_LIMITED_MESSAGE = "Spotify is rate limiting Artimix right now. Please try again in a minute."
+
+def make_spotify_client(access_token=None, user_id=None):
+    """A client for one access token or, given `user_id`, one that takes the user's current token for every call."""
+    if user_id is not None: return RateLimitedSpotify(auth_manager=SessionTokenAuth(user_id))
+    return RateLimitedSpotify(auth=access_token)
+
+# --- Session Store ---
+token_refresh_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="artimix-token-refresh")
+
+class SessionStore:
+    """Server-side login sessions: the cookie carries only a session ID, tokens and profiles stay here.
+
+    Sessions and users are kept in memory in front of SQLite, so authenticating a request is a dict
+    lookup. Access tokens are refreshed once per user however many requests need them: within
+    TOKEN_REFRESH_MARGIN_SECONDS of expiry a refresh starts in the background while the current
+    token is still handed out, and a token that is (nearly) expired is refreshed by the first
+    request that needs it while concurrent requests wait for the same result.
+    """
+
+    def __init__(self, session_ttl, memory_entries):
+        self.session_ttl = session_ttl
+        self.memory_entries = memory_entries
+        self._sessions = OrderedDict() # sid -> (user_id, expires_at, checked_at)
+        self._users = OrderedDict()    # user_id -> {"token_info": ..., "user_info": ...}
+        self._refreshes = SingleFlight()
+        self._background_refreshes = set()
+        self._lock = threading.Lock()
+        ensure_schema("CREATE TABLE IF NOT EXISTS auth_users (user_id TEXT PRIMARY KEY, token_info TEXT NOT NULL, "
+                      "user_info TEXT NOT NULL, updated_at REAL NOT NULL)",
+                      "CREATE TABLE IF NOT EXISTS auth_sessions (sid TEXT PRIMARY KEY, user_id TEXT NOT NULL, expires_at REAL NOT NULL)")
+
+    def create(self, token_info, user_info):
+        """Stores a user's fresh login and returns the ID of a new session for it."""
+        sid = uuid.uuid4().hex; expires_at = time.time() + self.session_ttl
+        self._save_user(user_info['id'], {"token_info": token_info, "user_info": user_info})
+        with _db_lock:
+            conn = get_db()
+            with conn:
+                conn.execute("DELETE FROM auth_sessions WHERE expires_at <= ?", (time.time(),))
+                conn.execute("INSERT INTO auth_sessions (sid, user_id, expires_at) VALUES (?, ?, ?)", (sid, user_info['id'], expires_at))
+        with self._lock: self._remember(self._sessions, sid, (user_info['id'], expires_at, time.monotonic()))
+        return sid
+
+    def user_id(self, sid):
+        """Returns the user a session belongs to, or None if it does not exist or has expired.
+
+        Cached sessions are re-read after SESSION_RECHECK_SECONDS, so a logout handled by another
+        worker takes effect here within that time.
+        """
+        with self._lock:
+            entry = self._sessions.get(sid)
+            if entry and time.monotonic() - entry[2] > SESSION_RECHECK_SECONDS: entry = None
+            elif entry: self._sessions.move_to_end(sid)
+        if entry is None:
+            with _db_lock:
+                row = get_db().execute("SELECT user_id, expires_at FROM auth_sessions WHERE sid = ?", (sid,)).fetchone()
+            with self._lock:
+                if row is None:
+                    self._sessions.pop(sid, None); return None
+                entry = (row[0], row[1], time.monotonic())
+                self._remember(self._sessions, sid, entry)
+        return entry[0] if entry[1] > time.time() else None
+
+    def user_info(self, user_id):
+        user = self._user(user_id)
+        return user['user_info'] if user else None
+
+    def update_user_info(self, user_id, user_info):
+        user = self._user(user_id)
+        if user: self._save_user(user_id, {**user, "user_info": user_info})
+
+    def access_token(self, user_id):
+        """Returns a usable access token for the user, or None if they have to log in again."""
+        user = self._user(user_id)
+        if user is None: return None
+        seconds_left = user['token_info']['expires_at'] - time.time()
+        if seconds_left > TOKEN_REFRESH_MARGIN_SECONDS:
+            return user['token_info']['access_token']
+        if seconds_left > TOKEN_MIN_VALID_SECONDS:
+            self._refresh_in_background(user_id)
+            return user['token_info']['access_token']
+        token_info = self._refreshes.do(user_id, lambda: self._refresh(user_id))
+        return token_info['access_token'] if token_info else None
+
+    def delete(self, sid):
+        with self._lock: self._sessions.pop(sid, None)
+        with _db_lock:
+            conn = get_db()
+            with conn: conn.execute("DELETE FROM auth_sessions WHERE sid = ?", (sid,))
+
+    def _refresh(self, user_id):
+        """Refreshes the user's token unless another worker already did; returns the token info or None."""
+        with _db_lock:
+            row = get_db().execute("SELECT token_info, user_info FROM auth_users WHERE user_id = ?", (user_id,)).fetchone()
+        if row is None: return None
+        user = {"token_info": json.loads(row[0]), "user_info": json.loads(row[1])}
+        if user['token_info']['expires_at'] - time.time() > TOKEN_REFRESH_MARGIN_SECONDS:
+            with self._lock: self._remember(self._users, user_id, user) # Refreshed by another process
+            return user['token_info']
+        try:
+            token_info = get_spotify_oauth().refresh_access_token(user['token_info']['refresh_token'])
+        except spotipy.SpotifyOauthError as e:
+            print(f"DEBUG: session store - Token refresh for '{user_id}' was refused: {e}")
+            return None
+        self._save_user(user_id, {**user, "token_info": token_info})
+        return token_info
+
+    def _refresh_in_background(self, user_id):
+        with self._lock:
+            if user_id in self._background_refreshes: return
+            self._background_refreshes.add(user_id)
+        def refresh():
+            try:
+                self._refreshes.do(user_id, lambda: self._refresh(user_id))
+            except Exception as e:
+                print(f"DEBUG: session store - Background token refresh for '{user_id}' failed: {e}")
+            finally:
+                with self._lock: self._background_refreshes.discard(user_id)
+        token_refresh_pool.submit(refresh)
+
+    def _user(self, user_id):
+        with self._lock:
+            user = self._users.get(user_id)
+            if user: self._users.move_to_end(user_id)
+        if user is None:
+            with _db_lock:
+                row = get_db().execute("SELECT token_info, user_info FROM auth_users WHERE user_id = ?", (user_id,)).fetchone()
+            if row is None: return None
+            user = {"token_info": json.loads(row[0]), "user_info": json.loads(row[1])}
+            with self._lock: self._remember(self._users, user_id, user)
+        return user
+
+    def _save_user(self, user_id, user):
+        with _db_lock:
+            conn = get_db()
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO auth_users (user_id, token_info, user_info, updated_at) VALUES (?, ?, ?, ?)",
+                             (user_id, json.dumps(user['token_info']), json.dumps(user['user_info']), time.time()))
+        with self._lock: self._remember(self._users, user_id, user)
+
+    def _remember(self, entries, key, value):
+        entries[key] = value
+        entries.move_to_end(key)
+        while len(entries) > self.memory_entries:
+            entries.popitem(last=False)
+
+session_store = SessionStore(session_ttl=SESSION_TTL_SECONDS, memory_entries=SESSION_MEMORY_ENTRIES)
+
+class SessionTokenAuth:
+    """spotipy auth manager for background work: asks session_store for the user's token on every call,
+    so jobs that outlive one access token keep working."""
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+
+    def get_access_token(self, as_dict=False):
+        access_token = session_store.access_token(self.user_id)
+        if access_token is None:
+            raise spotipy.SpotifyOauthError(f"No usable login for {self.user_id}; they have to log in again.")
+        return access_token
+
+def current_session_user_id():
+    """Returns the logged-in user's Spotify ID from the session cookie, or None."""
+    sid = session.get('sid')
+    return session_store.user_id(sid) if sid else None
+
+def current_user_info():
+    user_id = current_session_user_id()
+    return session_store.user_info(user_id) if user_id else None
+
 # --- Helper Functions ---
+_spotify_oauth = None
+
 def get_spotify_oauth():
-    return SpotifyOAuth(
-        client_id=SPOTIFY_CLIENT_ID,
-        client_secret=SPOTIFY_CLIENT_SECRET,
-        redirect_uri=SPOTIPY_REDIRECT_URI,
-        scope=SCOPE,
-        cache_path=".spotifycache" 
-    )
+    global _spotify_oauth
+    if _spotify_oauth is None:
+        _spotify_oauth = SpotifyOAuth(
+            client_id=SPOTIFY_CLIENT_ID,
+            client_secret=SPOTIFY_CLIENT_SECRET,
+            redirect_uri=SPOTIPY_REDIRECT_URI,
+            scope=SCOPE,
+            cache_handler=MemoryCacheHandler(), # Tokens live in session_store, per user
+            requests_session=spotify_http_session
+        )
+    return _spotify_oauth
 
 def get_spotify_client():
-    token_info = session.get("token_info", None)
-    if not token_info:
+    user_id = current_session_user_id()
+    if not user_id:
         return None
-    sp_oauth = get_spotify_oauth()
-    if sp_oauth.is_token_expired(token_info):
-        try:
-            token_info = sp_oauth.refresh_access_token(token_info['refresh_token'])
-            session["token_info"] = token_info
-        except spotipy.SpotifyOauthError as e:
-            session.clear(); return None
-    return spotipy.Spotify(auth=token_info['access_token'])
+    access_token = session_store.access_token(user_id)
+    if not access_token:
+        session.clear(); return None
+    return make_spotify_client(access_token)
 
 def get_artist_details_with_search(sp, artist_name_query):
     """Searches for an artist by name and returns details."""
@@ -60,85 +1461,669 @@ def get_artist_details_with_search(sp, artist_name_query):
         search_results = sp.search(q=f"artist:{artist_name_query}", type="artist", limit=1)
         if search_results and search_results['artists']['items']:
             artist_item = search_results['artists']['items'][0]
+            artist_index.add_many([artist_item])
             image_url = artist_item['images'][0]['url'] if artist_item.get('images') else None
             return {"id": artist_item['id'], "name": artist_item['name'], "image_url": image_url}
     except Exception as e:
+        if is_rate_limited(e): raise
         print(f"DEBUG: get_artist_details_with_search - Error for '{artist_name_query}': {e}")
     return None
 
 def get_artist_details_by_id(sp, artist_id):
-    """Fetches artist details directly by their Spotify ID."""
+    """Returns artist details for a Spotify ID, from the catalog cache or Spotify."""
+    cached = catalog_cache.get(f"artist:{artist_id}")
+    if cached: return cached
     try:
         artist_item = sp.artist(artist_id)
         if artist_item:
+            artist_index.add_many([artist_item])
             image_url = artist_item['images'][0]['url'] if artist_item.get('images') else None
-            return {"id": artist_item['id'], "name": artist_item['name'], "image_url": image_url}
+            details = {"id": artist_item['id'], "name": artist_item['name'], "image_url": image_url}
+            catalog_cache.set(f"artist:{artist_id}", details, ARTIST_DETAILS_TTL)
+            return details
     except Exception as e:
+        if is_rate_limited(e): raise
         print(f"DEBUG: get_artist_details_by_id - Error for ID '{artist_id}': {e}")
     return None
 
 
-def get_all_artist_tracks_with_details(sp, artist_id, artist_name_for_log, limit_per_album=50, max_albums_to_scan=10, max_tracks_to_return=150):
-    tracks_info = []; seen_track_uris = set()
+def _image_url(item):
+    return item['images'][0]['url'] if item.get('images') else None
+
+def _track_summary(track, album):
+    summary = {'uri': track['uri'], 'name': track['name'], 'artist_ids': [a['id'] for a in track['artists']],
+               'artist_names': [a['name'] for a in track['artists']], 'album_id': album['id'], 'image_url': _image_url(album)}
+    isrc = (track.get('external_ids') or {}).get('isrc') # Only full track objects carry it
+    if isrc: summary['isrc'] = isrc
+    return summary
+
+_REISSUE_SUFFIX = re.compile(r"\s*(?:-\s*[^-]*|[(\[][^)\]]*[)\]])\s*$")
+_REISSUE_WORDS = re.compile(r"\b(?:remaster(?:ed)?|deluxe|anniversary|expanded|bonus|mono|stereo|reissue)\b")
+
+def normalize_track_title(title):
+    """Strips re-release decorations ("- Remastered 2011", "(Deluxe Edition)") so reissues share one title."""
+    normalized = title.lower().strip()
+    while True:
+        suffix = _REISSUE_SUFFIX.search(normalized)
+        if not suffix or not _REISSUE_WORDS.search(suffix.group(0)): break
+        normalized = normalized[:suffix.start()].rstrip()
+    return " ".join(normalized.split())
+
+def _compact_album(album):
+    return {'id': album['id'], 'name': album['name'], 'image_url': _image_url(album),
+            'album_group': album.get('album_group') or album.get('album_type', 'album'), 'release_date': album.get('release_date', '')}
+
+def _compact_album_list(pages):
+    """Merges release-list pages into one list of compact albums, each album once."""
+    albums = []; seen_album_ids = set()
+    for page in pages:
+        for album in page.get('items', []):
+            if album and album['id'] not in seen_album_ids:
+                seen_album_ids.add(album['id'])
+                albums.append(_compact_album(album))
+    return albums
+
+def _cache_album_list_when_complete(cache_key, first_page, page_futures):
+    """Caches the full release list once the last page future finishes, if every page arrived."""
+    remaining = [len(page_futures)]; remaining_lock = threading.Lock()
+    def page_done(_):
+        with remaining_lock:
+            remaining[0] -= 1
+            if remaining[0]: return
+        if any(future.exception() for future in page_futures): return
+        catalog_cache.set(cache_key, _compact_album_list([first_page] + [future.result() for future in page_futures]), ARTIST_ALBUMS_TTL)
+    for future in page_futures: future.add_done_callback(page_done)
+
+def get_artist_albums_cached(sp, artist_id, deadline=None, album_pool=None):
+    """Returns an artist's complete release list (every album group, every page), cached once complete.
+
+    Pages after the first are fetched concurrently on `album_pool` (album_fetch_pool by default).
+    If some have not arrived by `deadline`, the partial list is returned for this request; the
+    full list is cached when the late pages land.
+    """
+    cache_key = f"albums:{artist_id}"
+    albums = catalog_cache.get(cache_key)
+    if albums is not None:
+        return albums
+    first_page = sp.artist_albums(artist_id, include_groups=DISCOGRAPHY_ALBUM_GROUPS, limit=ARTIST_ALBUMS_PAGE_SIZE)
+    if not first_page: return []
+    page_futures = [(album_pool or album_fetch_pool).submit(sp.artist_albums, artist_id, include_groups=DISCOGRAPHY_ALBUM_GROUPS,
+                                                            limit=ARTIST_ALBUMS_PAGE_SIZE, offset=offset)
+                    for offset in range(ARTIST_ALBUMS_PAGE_SIZE, first_page.get('total', 0), ARTIST_ALBUMS_PAGE_SIZE)]
+    if not page_futures:
+        albums = _compact_album_list([first_page])
+        catalog_cache.set(cache_key, albums, ARTIST_ALBUMS_TTL)
+        return albums
+    _cache_album_list_when_complete(cache_key, first_page, page_futures)
+    wait(page_futures, timeout=_seconds_left(deadline))
+    pages = [first_page]
+    for future in page_futures:
+        if future.done() and not future.exception():
+            pages.append(future.result())
+        elif future.done() and is_rate_limited(future.exception()):
+            raise future.exception()
+    return _compact_album_list(pages)
+
+def _fetch_album_batch(sp, album_ids):
+    """Fetches up to ALBUMS_BATCH_SIZE full albums in one call and caches each album's complete tracklist."""
+    tracks_by_album = {}
+    albums_response = sp.albums(album_ids)
+    for album in (albums_response or {}).get('albums', []):
+        if not album: continue
+        track_page = album['tracks']; track_items = list(track_page['items'])
+        while track_page.get('next') and len(track_items) < track_page.get('total', 0):
+            track_page = sp.album_tracks(album['id'], limit=ALBUM_TRACKS_PAGE_SIZE, offset=len(track_items))
+            if not track_page or not track_page['items']: break
+            track_items.extend(track_page['items'])
+        tracks = [_track_summary(track, album) for track in track_items]
+        catalog_cache.set(f"album:{album['id']}", tracks, ALBUM_TRACKS_TTL)
+        tracks_by_album[album['id']] = tracks
+    return tracks_by_album
+
+def get_albums_tracks_cached(sp, album_ids, deadline=None, album_pool=None):
+    """Returns {album_id: track summaries}, batching cache misses into concurrent multi-album lookups.
+
+    Batches that have not arrived by `deadline` (a time.monotonic() value) are left out; they
+    still finish in the background and land in the catalog cache for the next request.
+    """
+    cached = catalog_cache.get_many([f"album:{album_id}" for album_id in album_ids])
+    tracks_by_album = {key[len("album:"):]: tracks for key, tracks in cached.items()}
+    missing = [album_id for album_id in album_ids if album_id not in tracks_by_album]
+    batch_futures = [(album_pool or album_fetch_pool).submit(_fetch_album_batch, sp, missing[i:i + ALBUMS_BATCH_SIZE])
+                     for i in range(0, len(missing), ALBUMS_BATCH_SIZE)]
+    wait(batch_futures, timeout=_seconds_left(deadline))
+    for future in batch_futures:
+        if not future.done(): continue
+        if future.exception():
+            if is_rate_limited(future.exception()): raise future.exception()
+            print(f"DEBUG: get_albums_tracks_cached - Error fetching an album batch: {future.exception()}")
+            continue
+        tracks_by_album.update(future.result())
+    return tracks_by_album
+
+def get_artist_top_tracks_cached(sp, artist_id):
+    cache_key = f"top:{artist_id}"
+    tracks = catalog_cache.get(cache_key)
+    if tracks is not None:
+        return tracks
+    top_tracks_results = sp.artist_top_tracks(artist_id)
+    tracks = [_track_summary(track, track['album']) for track in top_tracks_results['tracks']] if top_tracks_results else []
+    catalog_cache.set(cache_key, tracks, TOP_TRACKS_TTL)
+    return tracks
+
+def get_all_artist_tracks_with_details(sp, artist_id, artist_name_for_log, max_tracks_to_return=None, deadline=None, progress=None, interner=None,
+                                       album_pool=None):
+    """Crawls an artist's whole discography into one candidate list of Track records, one per song.
+
+    Releases are visited album-first and oldest-first, so a song's original release wins over
+    its singles, compilations and remasters; duplicates are recognised by URI, ISRC or, when
+    either side carries a reissue decoration, normalized title (plain titles like "Intro" are
+    not merged). On appears_on/compilation releases only the artist's own tracks count.
+    Top tracks are weighted up (or added if the crawl missed them). Pass one `interner` to every
+    crawl of a request so artists and albums shared between pools are stored once.
+    """
+    interner = interner or RecordInterner()
+    tracks_info = []; seen_track_uris = set(); seen_isrcs = set(); index_by_title = {}; reissue_positions = set()
+
+    def add_track(track, restrict_to_artist=False):
+        if restrict_to_artist and artist_id not in track.artist_ids: return None
+        if track.uri in seen_track_uris or (track.isrc and track.isrc in seen_isrcs): return None
+        title_key = normalize_track_title(track.name)
+        is_reissue = title_key != " ".join(track.name.lower().split())
+        position = index_by_title.get(title_key)
+        if position is not None and (is_reissue or position in reissue_positions): return position
+        tracks_info.append(track); seen_track_uris.add(track.uri)
+        if track.isrc: seen_isrcs.add(track.isrc)
+        position = len(tracks_info) - 1
+        index_by_title.setdefault(title_key, position)
+        if is_reissue: reissue_positions.add(position)
+        return position
+
     try:
-        album_types = ['album', 'single']; all_album_items_from_api = []
-        for album_type in album_types:
-            offset = 0; albums_fetched_this_type = 0
-            while albums_fetched_this_type < max_albums_to_scan:
-                limit = min(50, max_albums_to_scan - albums_fetched_this_type)
-                if limit <=0: break
-                album_results = sp.artist_albums(artist_id, album_type=album_type, limit=limit, offset=offset)
-                if not album_results or not album_results['items']: break
-                all_album_items_from_api.extend(album_results['items'])
-                albums_fetched_this_type += len(album_results['items']); offset += len(album_results['items'])
-                if not album_results['next']: break
-        unique_album_ids = list({album['id'] for album in all_album_items_from_api}); random.shuffle(unique_album_ids)
-        for i, album_id_iter in enumerate(unique_album_ids): 
-            if i >= max_albums_to_scan or len(tracks_info) >= max_tracks_to_return: break
-            album_tracks_results = sp.album_tracks(album_id_iter, limit=limit_per_album) 
-            if album_tracks_results:
-                album_image_for_track = None
-                current_album_details = next((alb for alb in all_album_items_from_api if alb['id'] == album_id_iter), None) 
-                if current_album_details and current_album_details['images']: album_image_for_track = current_album_details['images'][0]['url']
-                for track in album_tracks_results['items']:
-                    if track['uri'] not in seen_track_uris:
-                        tracks_info.append({'uri': track['uri'], 'name': track['name'], 
-                                            'artists_str': ", ".join([a['name'] for a in track['artists']]), 
-                                            'image_url': album_image_for_track })
-                        seen_track_uris.add(track['uri'])
-                        if len(tracks_info) >= max_tracks_to_return: break
-        if len(tracks_info) < max_tracks_to_return:
-            top_tracks_results = sp.artist_top_tracks(artist_id)
-            if top_tracks_results:
-                for track in top_tracks_results['tracks']:
-                    if len(tracks_info) >= max_tracks_to_return: break
-                    if track['uri'] not in seen_track_uris:
-                        album_image = track['album']['images'][0]['url'] if track['album']['images'] else None
-                        tracks_info.append({'uri': track['uri'], 'name': track['name'], 
-                                            'artists_str': ", ".join([a['name'] for a in track['artists']]), 
-                                            'image_url': album_image})
-                        seen_track_uris.add(track['uri'])
+        albums = sorted(get_artist_albums_cached(sp, artist_id, deadline=deadline, album_pool=album_pool),
+                        key=lambda album: (ALBUM_GROUP_PRIORITY.get(album.get('album_group'), len(ALBUM_GROUP_PRIORITY)), album.get('release_date', '')))
+        tracks_by_album = get_albums_tracks_cached(sp, [album['id'] for album in albums], deadline=deadline, album_pool=album_pool)
+        if progress: progress.add(albums_fetched=len(tracks_by_album))
+        for album in albums:
+            restrict_to_artist = album.get('album_group') in ('appears_on', 'compilation')
+            album_record = interner.album(album['id'], album['name'], album.get('image_url'))
+            for summary in tracks_by_album.get(album['id'], []):
+                add_track(interner.track(summary, album_record), restrict_to_artist)
+        if _seconds_left(deadline) != 0:
+            for summary in get_artist_top_tracks_cached(sp, artist_id):
+                track = interner.track(summary)
+                position = add_track(track)
+                if position is None: # Same URI or ISRC as a crawled track
+                    position = next((i for i, known in enumerate(tracks_info)
+                                     if known.uri == track.uri or (track.isrc and known.isrc == track.isrc)), None)
+                if position is not None:
+                    tracks_info[position].weight = TOP_TRACK_WEIGHT
     except Exception as e: 
-        pass
-    return tracks_info[:max_tracks_to_return]
+        if is_rate_limited(e): raise # An empty or short list would silently skew the mix
+        print(f"DEBUG: get_all_artist_tracks_with_details - Error for '{artist_name_for_log}' ({artist_id}): {e}")
+    if max_tracks_to_return is not None: tracks_info = tracks_info[:max_tracks_to_return]
+    if progress: progress.add(tracks_collected=len(tracks_info))
+    return tracks_info
+
+def _track_id(track_uri):
+    return track_uri.rsplit(':', 1)[-1]
+
+def _track_details(track):
+    return {'uri': track.uri, 'name': track.name, 'artists_str': track.artists_str, 'image_url': track.image_url}
+
+def remember_track_details(tracks):
+    """Caches display details for Track records so previews can be hydrated later without the candidate pools."""
+    catalog_cache.set_many({f"track:{track.id}": _track_details(track) for track in tracks}, TRACK_DETAILS_TTL)
+
+def get_track_details_cached(sp, track_uris):
+    """Returns display details for track URIs in order, fetching cache misses in batches of TRACKS_BATCH_SIZE."""
+    cached = catalog_cache.get_many([f"track:{_track_id(uri)}" for uri in track_uris])
+    details = {key[len("track:"):]: value for key, value in cached.items()}
+    missing = [_track_id(uri) for uri in track_uris if _track_id(uri) not in details]
+    interner = RecordInterner()
+    for i in range(0, len(missing), TRACKS_BATCH_SIZE):
+        tracks = [track for track in (sp.tracks(missing[i:i + TRACKS_BATCH_SIZE]) or {}).get('tracks', []) if track]
+        fetched = [interner.track(_track_summary(track, track['album'])) for track in tracks]
+        remember_track_details(fetched)
+        details.update((track.id, _track_details(track)) for track in fetched)
+    return [details[_track_id(uri)] for uri in track_uris if _track_id(uri) in details]
+
+class _RecordingProgress:
+    """Forwards progress increments and keeps their totals, so a shared crawl can credit later requesters."""
+
+    def __init__(self, progress):
+        self.progress = progress
+        self.totals = Counter()
+
+    def add(self, **increments):
+        self.totals.update(increments)
+        if self.progress: self.progress.add(**increments)
+
+class MixFetcher:
+    """Resolves artists and crawls discographies for one or more mixes, doing each artist only once.
+
+    A batch of mixes shares one fetcher, so an artist that appears in many mixes is looked up and
+    crawled once; its candidate pool is reused read-only by every mix that asks for it. Crawls
+    stop at `fetch_deadline_seconds` (None: crawl to the end) and run on the given pools.
+    """
+
+    def __init__(self, sp, fetch_deadline_seconds=PREVIEW_FETCH_DEADLINE_SECONDS, artist_pool=None, album_pool=None):
+        self.sp = sp; self.fetch_deadline_seconds = fetch_deadline_seconds
+        self.artist_pool = artist_pool or artist_fetch_pool; self.album_pool = album_pool or album_fetch_pool
+        self.interner = RecordInterner() # Collaborations and shared albums are held once across all pools
+        self.requested = Counter(); self.fetched = Counter() # kind -> calls asked for / actually made
+        self._results = {} # (kind, key) -> Future
+        self._lock = threading.Lock()
+
+    def _once(self, kind, key, fn):
+        with self._lock:
+            self.requested[kind] += 1
+            future = self._results.get((kind, key))
+            is_owner = future is None
+            if is_owner:
+                future = self._results[(kind, key)] = Future(); self.fetched[kind] += 1
+        if is_owner:
+            try: future.set_result(fn())
+            except BaseException as e: future.set_exception(e)
+        return future.result()
+
+    def resolve_artist(self, artist_query_name, confirmed_artist_id):
+        def resolve():
+            artist_details = None
+            if confirmed_artist_id:
+                artist_details = get_artist_details_by_id(self.sp, confirmed_artist_id)
+            if not artist_details:
+                artist_details = get_artist_details_with_search(self.sp, artist_query_name) # Fallback
+            return artist_details
+        return self._once("artist", confirmed_artist_id or normalize_artist_name(artist_query_name), resolve)
+
+    def artist_tracks(self, artist_id, artist_name, deadline=None, progress=None):
+        """The artist's candidate pool; the first caller's deadline applies to the shared crawl, and every caller's progress is credited."""
+        recorder = _RecordingProgress(progress)
+        def crawl():
+            return get_all_artist_tracks_with_details(self.sp, artist_id, artist_name, deadline=deadline, progress=recorder,
+                                                      interner=self.interner, album_pool=self.album_pool), recorder.totals
+        pool, totals = self._once("tracks", artist_id, crawl)
+        if progress and totals is not recorder.totals: progress.add(**totals) # Another mix ran the crawl
+        return pool
+
+    def stats(self):
+        with self._lock:
+            return {"artist_lookups": self.fetched["artist"], "artist_lookups_shared": self.requested["artist"] - self.fetched["artist"],
+                    "discographies_crawled": self.fetched["tracks"], "discographies_shared": self.requested["tracks"] - self.fetched["tracks"]}
+
+# --- Preview Jobs ---
+preview_job_pool = ThreadPoolExecutor(max_workers=PREVIEW_JOB_WORKERS, thread_name_prefix="artimix-preview-job")
+_preview_jobs = {} # job_id -> PreviewJob
+_preview_jobs_lock = threading.Lock()
+
+class PreviewJob:
+    """Status and progress counters of one background preview build."""
+
+    def __init__(self, user_id, artists_total):
+        self.user_id = user_id
+        self.status = "queued"
+        self.preview_id = None
+        self.error = None
+        self.result = {} # Extra outcome details, e.g. the playlist a batch mix was written to
+        self.started_at = self.finished_at = None
+        self.progress = {"artists_total": artists_total, "artists_resolved": 0, "albums_fetched": 0, "tracks_collected": 0}
+        self._lock = threading.Lock()
+
+    def add(self, **increments):
+        with self._lock:
+            for name, amount in increments.items():
+                self.progress[name] += amount
+
+    def snapshot(self):
+        with self._lock:
+            return {"status": self.status, "preview_id": self.preview_id, "error": self.error, "progress": dict(self.progress), **self.result}
+
+def _run_preview_job(job, build, args):
+    job.status = "running"; job.started_at = time.time()
+    try:
+        job.preview_id = build(*args, job)
+        job.status = "done"
+    except PreviewBuildError as e:
+        job.error = str(e); job.status = "failed"
+    except Exception as e:
+        print(f"DEBUG: preview job - Unexpected error: {e}")
+        job.error = "Server error: Could not build the preview."; job.status = "failed"
+    finally:
+        job.finished_at = time.time()
+
+def submit_preview_job(user_id, build, *args, artists_total=0, pool=None):
+    """Queues build(*args, job) on `pool` (the preview worker pool by default) and returns the job ID."""
+    job_id = str(uuid.uuid4()); job = PreviewJob(user_id, artists_total)
+    with _preview_jobs_lock:
+        cutoff = time.time() - PREVIEW_JOB_RETENTION_SECONDS
+        for old_id in [jid for jid, old in _preview_jobs.items() if old.finished_at and old.finished_at < cutoff]:
+            del _preview_jobs[old_id]
+        _preview_jobs[job_id] = job
+    (pool or preview_job_pool).submit(_run_preview_job, job, build, args)
+    return job_id
+
+def get_preview_job(job_id, user_id):
+    """Returns a status snapshot of the user's job, or None if it is unknown or belongs to someone else."""
+    with _preview_jobs_lock:
+        job = _preview_jobs.get(job_id)
+    if job is None or job.user_id != user_id:
+        return None
+    return job.snapshot()
+
+# --- Playlist Writing ---
+PLAYLIST_WRITE_CLAIM_SECONDS = 600 # A claim left by a crashed worker lapses after this
+ensure_schema("CREATE TABLE IF NOT EXISTS playlist_write_claims (preview_id TEXT PRIMARY KEY, claimed_until REAL NOT NULL)")
+
+def claim_playlist_write(preview_id):
+    """Marks a preview's playlist as being written, atomically across workers. False if another request holds it."""
+    now = time.time()
+    with _db_lock:
+        conn = get_db()
+        with conn:
+            return conn.execute("INSERT INTO playlist_write_claims (preview_id, claimed_until) VALUES (?, ?) "
+                                "ON CONFLICT (preview_id) DO UPDATE SET claimed_until = excluded.claimed_until WHERE claimed_until <= ?",
+                                (preview_id, now + PLAYLIST_WRITE_CLAIM_SECONDS, now)).rowcount == 1
+
+def release_playlist_write(preview_id):
+    with _db_lock:
+        conn = get_db()
+        with conn: conn.execute("DELETE FROM playlist_write_claims WHERE preview_id = ?", (preview_id,))
+
+class PlaylistWriteError(Exception):
+    """A playlist write that stopped part way; the preview keeps the checkpoint to resume from."""
+
+    def __init__(self, message, checkpoint, batches_total, batch_timings):
+        super().__init__(message)
+        self.checkpoint = checkpoint
+        self.batches_total = batches_total
+        self.batch_timings = batch_timings
+
+def write_playlist(sp, user_id, preview_id, preview_data):
+    """Creates the preview's playlist and adds its tracks in order, checkpointing after every batch.
+
+    The checkpoint (playlist ID and batches done) lives in the stored preview, so calling this
+    again after a failure resumes at the failed batch instead of creating a second playlist.
+    Returns (checkpoint, per-batch timings).
+    """
+    track_uris = preview_data['track_uris']
+    batches = [track_uris[i:i + PLAYLIST_ADD_BATCH_SIZE] for i in range(0, len(track_uris), PLAYLIST_ADD_BATCH_SIZE)]
+    checkpoint = preview_data.get('write_checkpoint'); batch_timings = []
+    try:
+        if checkpoint is None:
+            new_playlist = sp.user_playlist_create(user_id, preview_data['playlist_name'], public=False, description="Created with Artimix!")
+            checkpoint = {'playlist_id': new_playlist['id'], 'playlist_url': new_playlist['external_urls']['spotify'], 'batches_done': 0}
+            preview_store.save(preview_id, {**preview_data, 'write_checkpoint': checkpoint})
+        for batch_index in range(checkpoint['batches_done'], len(batches)):
+            started = time.perf_counter()
+            # Batches are appended one after another: Spotify has no ordered parallel insert, and the explicit
+            # position keeps a resumed batch exactly where it belongs
+            sp.playlist_add_items(checkpoint['playlist_id'], batches[batch_index], position=batch_index * PLAYLIST_ADD_BATCH_SIZE)
+            batch_timings.append({"batch": batch_index + 1, "tracks": len(batches[batch_index]), "seconds": round(time.perf_counter() - started, 3)})
+            checkpoint = {**checkpoint, 'batches_done': batch_index + 1}
+            preview_store.save(preview_id, {**preview_data, 'write_checkpoint': checkpoint})
+    except Exception as e:
+        raise PlaylistWriteError(f"Playlist creation error: {e}", checkpoint, len(batches), batch_timings) from e
+    return checkpoint, batch_timings
+
+# --- Batch Mixes ---
+batch_mix_pool = ThreadPoolExecutor(max_workers=BATCH_MIX_WORKERS, thread_name_prefix="artimix-batch-mix")
+# Batch crawls get their own, smaller fetch pools so they never queue ahead of interactive previews
+batch_artist_pool = ThreadPoolExecutor(max_workers=BATCH_MIX_WORKERS, thread_name_prefix="artimix-batch-artist")
+batch_album_pool = ThreadPoolExecutor(max_workers=max(1, MAX_CONCURRENT_SPOTIFY_CALLS // 2), thread_name_prefix="artimix-batch-album")
+_mix_batches = {} # batch_id -> MixBatch
+_mix_batches_lock = threading.Lock()
+
+def parse_mix_specs(data):
+    """Validates a batch body: {"mixes": [{"playlist_name", "playlist_length", "artists": [{"name", "id", "percentage"}]}]}.
+
+    A mix may also give a "seed" to reproduce an earlier mix. Returns one (playlist name, playlist
+    length, artist requests, seed or None) per mix, in build_preview's format. Raises ValueError
+    naming the first bad mix.
+    """
+    mixes = data.get('mixes') if isinstance(data, dict) else None
+    if not isinstance(mixes, list) or not mixes:
+        raise ValueError('Expected {"mixes": [...]} with at least one mix.')
+    if len(mixes) > MAX_BATCH_MIXES:
+        raise ValueError(f"A batch holds at most {MAX_BATCH_MIXES} mixes.")
+    specs = []
+    for number, mix in enumerate(mixes, 1):
+        try:
+            playlist_length = int(mix.get('playlist_length') or DEFAULT_PLAYLIST_LENGTH)
+            seed = int(mix['seed']) if mix.get('seed') is not None else None
+            artist_requests = [((artist.get('name') or artist.get('id') or "").strip(), artist.get('id') or None, int(artist['percentage']))
+                               for artist in mix['artists']]
+        except (AttributeError, KeyError, TypeError, ValueError):
+            raise ValueError(f"Mix {number}: expected a playlist_length, a whole-number seed and artists as {{name or id, percentage}}.")
+        if not (0 < playlist_length <= MAX_PLAYLIST_LENGTH): raise ValueError(f"Mix {number}: playlist length must be 1-{MAX_PLAYLIST_LENGTH}.")
+        if not artist_requests: raise ValueError(f"Mix {number}: add at least one artist.")
+        if not all(name for name, _, _ in artist_requests): raise ValueError(f"Mix {number}: every artist needs a name or an ID.")
+        if not all(0 < percentage <= 100 for _, _, percentage in artist_requests): raise ValueError(f"Mix {number}: percentages must be 1-100.")
+        specs.append((str(mix.get('playlist_name') or f"Artimix Mix {number}"), playlist_length, artist_requests, seed))
+    return specs
+
+def build_batch_mix(sp, user_id, playlist_name, playlist_length, artist_requests, seed, fetcher, create_playlist, progress):
+    """Builds one mix of a batch with the batch's shared fetcher and, if asked, writes it to a new playlist."""
+    preview_id = build_preview(sp, playlist_name, playlist_length, artist_requests, progress, fetcher=fetcher, seed=seed)
+    preview_data = preview_store.load(preview_id)
+    result = {"track_count": preview_data['total_songs_in_playlist'], "seed": preview_data['seed']}
+    if create_playlist:
+        try:
+            checkpoint, _ = write_playlist(sp, user_id, preview_id, preview_data)
+        except PlaylistWriteError as e:
+            raise PreviewBuildError(str(e))
+        result["playlist_url"] = checkpoint['playlist_url']
+    progress.result = result
+    return preview_id
+
+class MixBatch:
+    """The jobs of one batch of mixes, with the fetcher and Spotify call trace they share."""
+
+    def __init__(self, user_id, fetcher, trace):
+        self.user_id = user_id; self.fetcher = fetcher; self.trace = trace
+        self.mixes = [] # (playlist name, job ID)
+        self.started_at = time.time()
+
+    def report(self):
+        """Every mix's job status plus throughput totals for the whole batch."""
+        with _preview_jobs_lock:
+            jobs = [(name, job_id, _preview_jobs.get(job_id)) for name, job_id in self.mixes]
+        mixes = []
+        for name, job_id, job in jobs:
+            mix = {"playlist_name": name, "job_id": job_id, **(job.snapshot() if job else {"status": "expired"})}
+            if job and job.finished_at: mix["seconds"] = round(job.finished_at - job.started_at, 3)
+            mixes.append(mix)
+        running = any(mix['status'] in ("queued", "running") for mix in mixes)
+        finished_at = max((job.finished_at for _, _, job in jobs if job and job.finished_at), default=self.started_at)
+        elapsed = max((time.time() if running else finished_at) - self.started_at, 1e-9)
+        done = [mix for mix in mixes if mix['status'] == "done"]
+        tracks = sum(mix.get('track_count', 0) for mix in done)
+        calls, _ = self.trace.totals()
+        report = {"status": "running" if running else "done", "mixes_total": len(mixes), "mixes_done": len(done),
+                  "mixes_failed": sum(mix['status'] == "failed" for mix in mixes), "elapsed_seconds": round(elapsed, 3),
+                  "mixes_per_minute": round(len(done) * 60 / elapsed, 2), "tracks_total": tracks, "tracks_per_second": round(tracks / elapsed, 1),
+                  "spotify_calls": calls, "spotify_calls_per_mix": round(calls / len(done), 1) if done else None, **self.fetcher.stats()}
+        return {"report": report, "mixes": mixes}
+
+def submit_mix_batch(user_id, specs, create_playlists=False):
+    """Queues every mix in `specs` on the batch worker pool with one shared MixFetcher; returns the batch ID.
+
+    Mixes run in parallel but all go through the process-wide Spotify rate limiter, so a batch
+    spends the same API budget as interactive requests rather than adding to it. Crawls run to
+    the end (no interactive deadline), since a cut-short pool would be shared by every mix that
+    uses the artist, and each call takes the user's current token from the session store.
+    """
+    sp = make_spotify_client(user_id=user_id)
+    sp.trace = RequestTrace() # Counts the batch's own Spotify calls for its report
+    fetcher = MixFetcher(sp, fetch_deadline_seconds=None, artist_pool=batch_artist_pool, album_pool=batch_album_pool)
+    batch_id = str(uuid.uuid4()); batch = MixBatch(user_id, fetcher, sp.trace)
+    for playlist_name, playlist_length, artist_requests, seed in specs:
+        batch.mixes.append((playlist_name, submit_preview_job(user_id, build_batch_mix, sp, user_id, playlist_name, playlist_length, artist_requests, seed,
+                                                              batch.fetcher, create_playlists, artists_total=len(artist_requests), pool=batch_mix_pool)))
+    with _preview_jobs_lock: live_job_ids = set(_preview_jobs)
+    with _mix_batches_lock:
+        for old_id in [bid for bid, old in _mix_batches.items() if not any(job_id in live_job_ids for _, job_id in old.mixes)]:
+            del _mix_batches[old_id] # Every job of the batch has expired
+        _mix_batches[batch_id] = batch
+    return batch_id
+
+def get_mix_batch(batch_id, user_id):
+    """Returns the report of the user's batch, or None if it is unknown or belongs to someone else."""
+    with _mix_batches_lock:
+        batch = _mix_batches.get(batch_id)
+    if batch is None or batch.user_id != user_id:
+        return None
+    return batch.report()
+
+@app.cli.command("build-mixes")
+@click.argument("spec_file", type=click.File())
+@click.option("--user", "user_id", required=True, help="Spotify user ID to build as; they must have logged in to Artimix before.")
+@click.option("--create-playlists", is_flag=True, help="Write every mix to a new private playlist instead of only storing its preview.")
+def build_mixes_command(spec_file, user_id, create_playlists):
+    """Builds every mix in SPEC_FILE (the JSON body /batch_mixes takes) and prints a throughput report."""
+    try:
+        data = json.load(spec_file)
+        specs = parse_mix_specs(data)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    if not session_store.access_token(user_id):
+        raise click.ClickException(f"No usable login for {user_id}. Log in to Artimix as that user first.")
+    batch_id = submit_mix_batch(user_id, specs, create_playlists or bool(data.get('create_playlists')))
+    reported = set()
+    while True:
+        batch = get_mix_batch(batch_id, user_id)
+        for mix in batch['mixes']:
+            if mix['job_id'] in reported or mix['status'] in ("queued", "running"): continue
+            reported.add(mix['job_id'])
+            outcome = mix.get('playlist_url') or (f"preview {mix['preview_id']}, {mix['track_count']} tracks" if mix['status'] == "done" else mix.get('error'))
+            click.echo(f"{mix['status']:>7} {mix['playlist_name']}: {outcome}")
+        if batch['report']['status'] == "done": break
+        time.sleep(0.5)
+    click.echo(json.dumps(batch['report'], indent=2))
+
+# --- Mix Selection ---
+def apportion_quotas(weights, total, capacities):
+    """Splits `total` slots between entries in proportion to `weights` (largest-remainder method).
+
+    No entry gets more than its capacity; slots an entry cannot fill are re-apportioned among
+    the entries that still have room.
+    """
+    quotas = [0] * len(weights)
+    remaining = min(total, sum(capacities))
+    while remaining > 0:
+        open_entries = [i for i, weight in enumerate(weights) if weight > 0 and quotas[i] < capacities[i]]
+        if not open_entries: break
+        weight_sum = sum(weights[i] for i in open_entries)
+        exact = {i: remaining * weights[i] / weight_sum for i in open_entries}
+        shares = {i: int(exact[i]) for i in open_entries}
+        leftover = remaining - sum(shares.values())
+        for i in sorted(open_entries, key=lambda i: exact[i] - shares[i], reverse=True)[:leftover]:
+            shares[i] += 1
+        for i in open_entries:
+            granted = min(shares[i], capacities[i] - quotas[i])
+            quotas[i] += granted; remaining -= granted
+    return quotas
+
+def weighted_order(tracks, rng):
+    """Orders tracks by a weighted random key (Efraimidis-Spirakis); any prefix is a weighted sample without replacement."""
+    return sorted(tracks, key=lambda track: rng.random() ** (1.0 / track.weight), reverse=True)
+
+def weighted_sample(tracks, count, rng):
+    if count >= len(tracks): return weighted_order(tracks, rng)
+    return heapq.nlargest(count, tracks, key=lambda track: rng.random() ** (1.0 / track.weight))
+
+def dedupe_candidate_pools(pools):
+    """Drops tracks already present in an earlier artist's pool, so collaborations are counted once."""
+    seen_uris = set(); deduped = []
+    for pool in pools:
+        deduped.append([track for track in pool if track.uri not in seen_uris])
+        seen_uris.update(track.uri for track in pool)
+    return deduped
+
+def new_mix_seed():
+    return random.randrange(2 ** 32)
+
+def mix_pool_key(artist_id, roll=0):
+    """Names one artist's random stream within a seed; re-rolling the artist moves it to the next stream."""
+    return f"{artist_id}:{roll}" if roll else artist_id
+
+def select_mix(pools, weights, playlist_length, seed, pool_keys):
+    """Picks a playlist of `playlist_length` tracks whose artist shares follow `weights`.
+
+    `pools` holds one candidate list per artist. Each artist's picks come from its own generator,
+    seeded with f"{seed}:{pool key}", and are a prefix of that artist's weighted order; the
+    playlist is then ordered by a per-track hash of the seed. So the same seed and pools always
+    give the same playlist, and changing one artist's share or roll only adds or removes tracks at
+    the tails of the artists' picks. Returns (ordered tracks, per-artist counts).
+    """
+    pools = dedupe_candidate_pools(pools)
+    quotas = apportion_quotas(weights, playlist_length, [len(pool) for pool in pools])
+    selected = []
+    for pool, quota, pool_key in zip(pools, quotas, pool_keys):
+        selected.extend(weighted_sample(pool, quota, random.Random(f"{seed}:{pool_key}")))
+    selected.sort(key=lambda track: zlib.crc32(f"{seed}:{track.uri}".encode()))
+    return selected, quotas
+
+def _stored_pool(artist_entry):
+    """Bare Track records for a candidate pool stored with a preview: enough for select_mix, not for display."""
+    top_positions = set(artist_entry['top'])
+    return [Track(f"spotify:track:{track_id}", None, (), None, weight=TOP_TRACK_WEIGHT if position in top_positions else 1.0)
+            for position, track_id in enumerate(artist_entry['pool'].split(",")) if track_id]
+
+def store_mix(preview_id, playlist_name, playlist_length, seed, artists, pools):
+    """Selects the mix from deduped candidate pools and saves it as a preview; returns the saved preview data.
+
+    `artists` are dicts of id, name, image_url, percentage and roll, one per pool. The seed and
+    the pools (as track IDs) are saved too, so adjust_preview can redo the selection without
+    Spotify. Previews too large to hold their pools are saved without them.
+    """
+    tracks, counts = select_mix(pools, [artist['percentage'] for artist in artists], playlist_length, seed,
+                                [mix_pool_key(artist['id'], artist['roll']) for artist in artists])
+    if not tracks:
+        raise PreviewBuildError("No tracks selected. Try different artists/percentages.")
+    remember_track_details([track for track in tracks if track.name is not None]) # Stored pools hold no display details
+
+    artists = [{key: artist[key] for key in ('id', 'name', 'image_url', 'percentage', 'roll')} for artist in artists]
+    preview_data = {
+        'playlist_name': playlist_name,
+        'playlist_length': playlist_length,
+        'seed': seed,
+        'track_uris': [track.uri for track in tracks],
+        'artist_contributions': [{"name": artist['name'], "image_url": artist['image_url'], "count": count, "requested_percentage": artist['percentage']}
+                                 for artist, count in zip(artists, counts)],
+        'total_songs_in_playlist': len(tracks),
+        'artists': [{**artist, 'pool': ",".join(track.id for track in pool), 'top': [i for i, track in enumerate(pool) if track.weight != 1.0]}
+                    for artist, pool in zip(artists, pools)]
+    }
+    try:
+        try:
+            preview_store.save(preview_id, preview_data)
+        except PreviewTooLargeError:
+            preview_data = {**preview_data, 'artists': artists} # Adjusting re-crawls the pools instead
+            preview_store.save(preview_id, preview_data)
+    except (PreviewTooLargeError, sqlite3.Error) as e:
+        raise PreviewBuildError("Server error: Could not save preview data.")
+    return preview_data
 
 # --- Flask Routes ---
 @app.route("/")
 def index():
     sp = get_spotify_client()
-    user_info = session.get('user_info')
+    user_info = current_user_info()
     error_message = request.args.get('error_message') 
     if sp and not user_info:
         try:
-            user_profile = sp.current_user()
-            user_info = {"name": user_profile.get('display_name', user_profile.get('id')),
-                         "image": user_profile['images'][0]['url'] if user_profile.get('images') else None}
-            session['user_info'] = user_info 
+            user_info = _user_info_from_profile(sp.current_user())
+            session_store.update_user_info(user_info['id'], user_info)
         except Exception as e:
             if "token" in str(e).lower(): session.clear(); return redirect(url_for("login")) 
             sp = None
     return render_template("index.html", user_logged_in=bool(sp), user_info=user_info, error_message=error_message)
 
+def _user_info_from_profile(user_profile):
+    return {"id": user_profile['id'], "name": user_profile.get('display_name', user_profile.get('id')),
+            "image": user_profile['images'][0]['url'] if user_profile.get('images') else None}
+
 @app.route("/login")
 def login():
     auth_url = get_spotify_oauth().get_authorize_url()
@@ -154,140 +2139,141 @@ def callback():
         return redirect(url_for("index", error_message="Spotify auth failed: No code"))
     try:
         token_info = sp_oauth.get_access_token(code, check_cache=False) 
-        session["token_info"] = token_info
-        sp_temp = spotipy.Spotify(auth=token_info['access_token'])
-        user_profile = sp_temp.current_user()
-        session['user_info'] = {"name": user_profile.get('display_name', user_profile.get('id')),
-                                "image": user_profile['images'][0]['url'] if user_profile.get('images') else None}
+        sp_temp = make_spotify_client(token_info['access_token'])
+        user_info = _user_info_from_profile(sp_temp.current_user())
+        session.clear()
+        session['sid'] = session_store.create(token_info, user_info)
         return redirect(url_for("index"))
     except Exception as e:
         return redirect(url_for("index", error_message=f"Auth error: {e}"))
 
 @app.route("/logout")
 def logout():
+    if session.get('sid'): session_store.delete(session['sid'])
     session.clear()
     return redirect(url_for("index"))
 
-# MODIFIED FUNCTION STARTS HERE
+def format_artist_suggestion(artist_item_data):
+    return {
+        "id": artist_item_data['id'],
+        "name": artist_item_data.get('name', 'Unknown Artist'),
+        "image_url": artist_item_data['images'][0]['url'] if artist_item_data.get('images') else None
+    }
+
+def parse_spotify_artist_url(query):
+    """Returns (is_artist_url, artist_id) for an open.spotify.com artist link."""
+    try:
+        parsed_url = urlparse(query)
+    except ValueError: # Malformed URL for urlparse
+        return False, None
+    if not (parsed_url.scheme in ['http', 'https'] and parsed_url.netloc == 'open.spotify.com' and '/artist/' in parsed_url.path):
+        return False, None
+    path_segments = parsed_url.path.strip('/').split('/')
+    artist_index = path_segments.index('artist')
+    if artist_index + 1 < len(path_segments) and path_segments[artist_index + 1]:
+        return True, path_segments[artist_index + 1]
+    return True, None
+
+def fetch_url_suggestions(sp, artist_id):
+    """The linked artist followed by its related artists (from the artist graph once it knows them)."""
+    suggestions = []
+    try:
+        artist_details = get_artist_details_by_id(sp, artist_id)
+        if artist_details:
+            suggestions.append(artist_details)
+            suggestions += artist_graph.related_artists(sp, artist_id)[:SUGGESTION_LIMIT - 1]
+    except spotipy.SpotifyException as se: # More specific exception for Spotify API errors
+        print(f"DEBUG: suggest_artists - Spotify API error fetching artist by ID {artist_id}: {se}")
+    except Exception as e_url:
+        print(f"DEBUG: suggest_artists - Generic error processing artist URL for ID {artist_id}: {e_url}")
+    return suggestions
+
+def fetch_text_suggestions(sp, query):
+    """Runs the Spotify artist search for a text query; quoted queries must appear in the artist name."""
+    is_quoted_search = query.startswith('"') and query.endswith('"') and len(query) >= 3 # e.g., "A"
+    if is_quoted_search:
+        search_term_for_filter = query[1:-1]
+        spotify_api_query_term = f'"{search_term_for_filter}"' # Use Spotify's exact phrase search
+        api_limit = 25
+    else:
+        search_term_for_filter = query
+        spotify_api_query_term = query
+        api_limit = 10 # Fetch a reasonable number for non-quoted for filtering
+
+    results = sp.search(q=f'artist:{spotify_api_query_term}', type="artist", limit=api_limit)
+    raw_spotify_items = results['artists']['items'] if results and results['artists']['items'] else []
+    artist_index.add_many(raw_spotify_items)
+
+    suggestions = []; processed_artist_ids = set()
+    for item in raw_spotify_items:
+        if not item or not item.get('id') or item['id'] in processed_artist_ids: continue
+        if is_quoted_search and search_term_for_filter.lower() not in item.get('name', '').lower(): continue
+        processed_artist_ids.add(item['id'])
+        suggestions.append(format_artist_suggestion(item))
+    # Unquoted searches keep the whole result page so longer queries can be answered from it
+    return suggestions[:SUGGESTION_LIMIT] if is_quoted_search else suggestions
+
 @app.route("/suggest_artists")
 def suggest_artists():
     sp = get_spotify_client()
     if not sp: 
         return jsonify({"error": "User not authenticated"}), 401
 
-    query = request.args.get("query", "").strip()
+    query = " ".join(request.args.get("query", "").split())
     if not query: 
         return jsonify([])
 
-    final_suggestions = []
-    processed_artist_ids = set()
-
-    def format_artist_item(artist_item_data):
-        if artist_item_data and artist_item_data.get('id') and artist_item_data['id'] not in processed_artist_ids:
-            processed_artist_ids.add(artist_item_data['id'])
-            return {
-                "id": artist_item_data['id'],
-                "name": artist_item_data.get('name', 'Unknown Artist'),
-                "image_url": artist_item_data['images'][0]['url'] if artist_item_data.get('images') else None
-            }
-        return None
+    is_artist_url, artist_id_from_url = parse_spotify_artist_url(query)
+    if is_artist_url:
+        if not artist_id_from_url:
+            print(f"DEBUG: suggest_artists - Could not extract valid artist ID from URL: {query}")
+            # It looked like a URL but ID extraction failed, so treat as bad URL, don't fall to text search
+            return jsonify([])
+        cache_key = f"url:{artist_id_from_url}"
+        suggestions = suggestion_cache.get(cache_key)
+        if suggestions is None:
+            suggestions = suggestion_flights.do(cache_key, lambda: fetch_url_suggestions(sp, artist_id_from_url))
+            if suggestions: suggestion_cache.set(cache_key, suggestions)
+        return jsonify(suggestions[:SUGGESTION_LIMIT])
 
-    # Attempt to parse query as a URL
-    try:
-        parsed_url = urlparse(query)
-        if parsed_url.scheme in ['http', 'https'] and \
-           parsed_url.netloc == 'open.spotify.com' and \
-           '/artist/' in parsed_url.path:
-            
-            path_segments = parsed_url.path.strip('/').split('/')
-            artist_id_from_url = None
-            if 'artist' in path_segments:
-                try:
-                    artist_index = path_segments.index('artist')
-                    if artist_index + 1 < len(path_segments):
-                        artist_id_from_url = path_segments[artist_index + 1]
-                except ValueError:
-                    pass # 'artist' not in path_segments as expected
-
-            if artist_id_from_url:
-                # print(f"DEBUG: suggest_artists - URL detected. Artist ID: {artist_id_from_url}")
-                try:
-                    artist_data = sp.artist(artist_id_from_url)
-                    suggestion = format_artist_item(artist_data)
-                    if suggestion:
-                        final_suggestions.append(suggestion)
-                    
-                    # Fetch related artists if primary artist found and need to pad to 5
-                    if artist_data and len(final_suggestions) < 5:
-                        related_artists_data = sp.artist_related_artists(artist_id_from_url)
-                        if related_artists_data and related_artists_data.get('artists'):
-                            for rel_artist in related_artists_data['artists']:
-                                if len(final_suggestions) >= 5: break
-                                rel_suggestion = format_artist_item(rel_artist)
-                                if rel_suggestion:
-                                    final_suggestions.append(rel_suggestion)
-                except spotipy.SpotifyException as se: # More specific exception for Spotify API errors
-                    print(f"DEBUG: suggest_artists - Spotify API error fetching artist by ID {artist_id_from_url}: {se}")
-                except Exception as e_url:
-                    print(f"DEBUG: suggest_artists - Generic error processing artist URL for ID {artist_id_from_url}: {e_url}")
-                
-                # If a URL was processed (even if it failed to find an artist), return its results.
-                return jsonify(final_suggestions[:5]) 
-            else:
-                print(f"DEBUG: suggest_artists - Could not extract valid artist ID from URL: {query}")
-                # It looked like a URL but ID extraction failed, so treat as bad URL, don't fall to text search
-                return jsonify([])
-
-
-    except ValueError: # Malformed URL for urlparse
-        # print(f"DEBUG: suggest_artists - Query '{query}' not a valid URL structure. Proceeding to text search.")
-        pass # Fall through to text search
+    normalized_query = query.lower()
+    is_quoted_search = query.startswith('"') and query.endswith('"') and len(query) >= 3
+    cache_key = f"{'quoted' if is_quoted_search else 'text'}:{normalized_query}"
+    local_suggestions = [] if is_quoted_search else artist_index.search(query, SUGGESTION_LIMIT)
+    # A full list of prefix matches, or the exact name of an artist we know, needs no network round trip
+    if local_suggestions and (artist_index.has_exact_name(query) or
+                              (len(local_suggestions) >= SUGGESTION_LIMIT and artist_index.all_prefix_matches(local_suggestions, query))):
+        return jsonify(local_suggestions)
+    suggestions = suggestion_cache.get(cache_key)
+    if suggestions is None and not is_quoted_search:
+        suggestions = suggestion_cache.get_from_related(normalized_query)
+    if suggestions is None:
+        try:
+            suggestions = suggestion_flights.do(cache_key, lambda: fetch_text_suggestions(sp, query))
+        except Exception as e:
+            print(f"DEBUG: suggest_artists - Error during text search for '{query}': {e}")
+            if local_suggestions: # e.g. rate limited: partial local results beat an error
+                return jsonify(local_suggestions)
+            return jsonify({"error": "Could not fetch suggestions"}), 500
+        suggestion_cache.set(cache_key, suggestions)
 
-    # If not a valid & processed Spotify URL, proceed with text search logic
-    is_quoted_search = query.startswith('"') and query.endswith('"') and len(query) >= 3 # e.g., "A"
-    
-    search_term_for_filter = "" 
-    spotify_api_query_term = query
+    # Spotify's ranking first, then any fuzzy local hits it did not return
+    suggestion_ids = {suggestion['id'] for suggestion in suggestions}
+    suggestions = suggestions + [suggestion for suggestion in local_suggestions if suggestion['id'] not in suggestion_ids]
+    return jsonify(suggestions[:SUGGESTION_LIMIT])
 
-    if is_quoted_search:
-        search_term_for_filter = query[1:-1] 
-        if not search_term_for_filter: return jsonify([]) # Empty quotes ""
-        spotify_api_query_term = f'"{search_term_for_filter}"' # Use Spotify's exact phrase search
-        api_limit = 25 
-    else:
-        search_term_for_filter = query 
-        api_limit = 10 # Fetch a reasonable number for non-quoted for filtering
+def wants_ndjson():
+    return request.args.get("stream") == "1" or "application/x-ndjson" in request.headers.get("Accept", "")
 
-    try:
-        spotify_q_param = f'artist:{spotify_api_query_term}'
-        # print(f"DEBUG: suggest_artists - Text search. Query: {spotify_q_param}, Limit: {api_limit}")
-        results = sp.search(q=spotify_q_param, type="artist", limit=api_limit) 
-        
-        raw_spotify_items = results['artists']['items'] if results and results['artists']['items'] else []
-
-        for item in raw_spotify_items:
-            if len(final_suggestions) >= 5: break
-            
-            suggestion_to_add = None
-            if is_quoted_search:
-                if search_term_for_filter.lower() in item.get('name', '').lower():
-                    suggestion_to_add = format_artist_item(item)
-            else: 
-                suggestion_to_add = format_artist_item(item)
-            
-            if suggestion_to_add:
-                final_suggestions.append(suggestion_to_add)
-        
-    except Exception as e:
-        print(f"DEBUG: suggest_artists - Error during text search for '{query}': {e}")
-        # Do not return error here if some results were already found (e.g. from a failed URL path that didn't return early)
-        # If final_suggestions is empty, then it's a true failure.
-        if not final_suggestions:
-            return jsonify({"error": "Could not fetch suggestions"}), 500
-    
-    # print(f"DEBUG: suggest_artists - Returning suggestions: {final_suggestions[:5]}")
-    return jsonify(final_suggestions[:5])
-# MODIFIED FUNCTION ENDS HERE
+def ndjson_response(pages, error_prefix):
+    """Streams an iterator of record lists as NDJSON, flushing one chunk per page."""
+    def generate():
+        try:
+            for page in pages:
+                yield "".join(json.dumps(record) + "\n" for record in page)
+        except Exception as e:
+            yield json.dumps({"error": f"{error_prefix}: {e}"}) + "\n"
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
 
 @app.route("/liked_songs")
 def liked_songs():
@@ -295,79 +2281,172 @@ def liked_songs():
     if not sp:
         return jsonify({"error": "User not authenticated"}), 401
 
-    songs = []
     try:
-        limit = 50
-        offset = 0
-        while True:
-            results = sp.current_user_saved_tracks(limit=limit, offset=offset)
-            items = results.get('items', [])
-            for item in items:
-                track = item['track']
-                songs.append({
-                    "id": track['id'],
-                    "name": track['name'],
-                    "artists": [artist['name'] for artist in track['artists']],
-                    "uri": track['uri'],
-                    "album": track['album']['name'],
-                    "image_url": track['album']['images'][0]['url'] if track['album']['images'] else None
-                })
-            if len(items) < limit:
-                break
-            offset += limit
+        user_id = get_current_user_id(sp)
+        if wants_ndjson():
+            pages = ([track.to_liked_song() for track in page] for page in iter_liked_library_pages(sp, user_id))
+            return ndjson_response(pages, "Could not fetch liked songs")
+        sync_liked_library(sp, user_id)
+        songs = [track.to_liked_song() for track in get_liked_library(user_id)]
     except Exception as e:
         return jsonify({"error": f"Could not fetch liked songs: {e}"}), 500
 
     return jsonify(songs)
 
 
+def _liked_artist_pages(sp, song_pages):
+    """Turns pages of saved tracks into pages of not-yet-seen artists with their images."""
+    seen_artist_ids = set()
+    for page in song_pages:
+        new_artists = {}
+        for track in page:
+            for artist in track.artists:
+                if artist.id not in seen_artist_ids and artist.id not in new_artists:
+                    new_artists[artist.id] = {"id": artist.id, "name": artist.name, "image_url": None}
+        if not new_artists: continue
+        for artist_id, image_url in get_artist_images_cached(sp, list(new_artists.keys())).items():
+            if artist_id in new_artists:
+                new_artists[artist_id]['image_url'] = image_url
+        seen_artist_ids.update(new_artists)
+        yield list(new_artists.values())
+
 @app.route("/liked_artists")
 def liked_artists():
     sp = get_spotify_client()
     if not sp:
         return jsonify({"error": "User not authenticated"}), 401
 
-    artist_map = {}
     try:
-        limit = 50
-        offset = 0
-        while True:
-            results = sp.current_user_saved_tracks(limit=limit, offset=offset)
-            items = results.get('items', [])
-            for item in items:
-                for artist in item['track']['artists']:
-                    if artist['id'] not in artist_map:
-                        artist_map[artist['id']] = {
-                            "id": artist['id'],
-                            "name": artist['name'],
-                            "image_url": None  # This will be populated below.
-                        }
-            if len(items) < limit:
-                break
-            offset += limit
-
-        # Optionally, fetch artist images in batches (Spotify API allows up to 50 IDs per call)
-        artist_ids = list(artist_map.keys())
-        for i in range(0, len(artist_ids), 50):
-            batch_ids = artist_ids[i:i+50]
-            batch_response = sp.artists(batch_ids)
-            for artist in batch_response.get('artists', []):
-                if artist and artist.get('id') in artist_map:
-                    artist_map[artist['id']]['image_url'] = artist['images'][0]['url'] if artist.get('images') else None
+        user_id = get_current_user_id(sp)
+        if wants_ndjson():
+            return ndjson_response(_liked_artist_pages(sp, iter_liked_library_pages(sp, user_id)), "Could not fetch liked artists")
+        sync_liked_library(sp, user_id)
+        artists = [artist for page in _liked_artist_pages(sp, [get_liked_library(user_id)]) for artist in page]
     except Exception as e:
         return jsonify({"error": f"Could not fetch liked artists: {e}"}), 500
 
-    return jsonify(list(artist_map.values()))
+    return jsonify(artists)
+
+class PreviewBuildError(Exception):
+    """A user-facing reason why a preview could not be built."""
+
+def fetch_candidate_pools(fetcher, artists, progress=None):
+    """Crawls each artist's candidate pool under the fetcher's deadline; pools come back deduped, in artist order."""
+    deadline = None if fetcher.fetch_deadline_seconds is None else time.monotonic() + fetcher.fetch_deadline_seconds
+    artist_track_futures = [fetcher.artist_pool.submit(fetcher.artist_tracks, artist_entry["id"], artist_entry["name"],
+                                                       deadline=deadline, progress=progress)
+                            for artist_entry in artists]
+    candidate_pools = []
+    for artist_tracks_future in artist_track_futures:
+        try:
+            candidate_pools.append(artist_tracks_future.result())
+        except spotipy.SpotifyException as e:
+            if not is_rate_limited(e): raise
+            raise PreviewBuildError(SPOTIFY_RATE_LIMITED_MESSAGE)
+    return dedupe_candidate_pools(candidate_pools)
+
+def build_preview(sp, playlist_name, playlist_length, artist_requests, progress, fetcher=None, seed=None):
+    """Resolves artists, collects their tracks, selects the mix and stores it; returns the preview ID.
+
+    `artist_requests` is a list of (query name, confirmed artist ID or None, percentage). Mixes
+    built with the same `fetcher` share artist lookups and discography crawls. The same `seed`
+    and candidates give the same mix; a new seed is drawn when none is given.
+    """
+    fetcher = fetcher or MixFetcher(sp)
+    def resolve_artist(artist_query_name, confirmed_artist_id):
+        artist_details = fetcher.resolve_artist(artist_query_name, confirmed_artist_id)
+        progress.add(artists_resolved=1)
+        return artist_details
+
+    try:
+        resolved_artists = list(fetcher.artist_pool.map(lambda req: resolve_artist(req[0], req[1]), artist_requests))
+    except spotipy.SpotifyException as e:
+        if not is_rate_limited(e): raise
+        raise PreviewBuildError(SPOTIFY_RATE_LIMITED_MESSAGE)
+    artists_form_data = []
+    for (artist_query_name, confirmed_artist_id, percentage), artist_details in zip(artist_requests, resolved_artists):
+        if not artist_details: continue # Could not verify this artist; mix the rest
+        artists_form_data.append({
+            "id": artist_details['id'],
+            "name": artist_details['name'], 
+            "image_url": artist_details['image_url'], 
+            "percentage": percentage,
+            "roll": 0
+        })
+    
+    if not artists_form_data:
+        raise PreviewBuildError("Add at least one artist.")
+
+    candidate_pools = fetch_candidate_pools(fetcher, artists_form_data, progress)
+    preview_id = str(uuid.uuid4()) 
+    store_mix(preview_id, playlist_name, playlist_length, new_mix_seed() if seed is None else seed, artists_form_data, candidate_pools)
+    return preview_id
+
+class PreviewNotAdjustableError(PreviewBuildError):
+    """The preview cannot be adjusted in place (it predates stored seeds, or is being written to Spotify)."""
+
+def adjust_preview(sp, preview_id, preview_data, artist_position=None, percentage=None, reroll=False):
+    """Re-selects a stored preview with one artist's share changed and/or their picks re-rolled; returns the new preview data.
+
+    Without an artist, `reroll` draws a new seed for the whole mix. Selection reuses the pools
+    stored with the preview and calls no Spotify API. A re-roll moves only that artist's picks.
+    A new percentage re-divides every artist's count, but each artist only gains or loses tracks
+    at the tail of their weighted order (see select_mix).
+    """
+    if 'seed' not in preview_data or 'artists' not in preview_data:
+        raise PreviewNotAdjustableError("This preview was made before previews could be adjusted. Generate it again.")
+    if preview_data.get('write_checkpoint'):
+        raise PreviewNotAdjustableError("This playlist is already being added to Spotify.")
+    artists = [dict(artist) for artist in preview_data['artists']]; seed = preview_data['seed']
+    if artist_position is None:
+        if reroll: seed = new_mix_seed()
+    else:
+        if not (0 <= artist_position < len(artists)): raise PreviewBuildError("No such artist in this preview.")
+        if percentage is not None: artists[artist_position]['percentage'] = percentage
+        if reroll: artists[artist_position]['roll'] += 1
+    if all('pool' in artist for artist in artists):
+        candidate_pools = [_stored_pool(artist) for artist in artists]
+    else: # Saved without its pools; the crawl is served from the catalog cache while that is fresh
+        candidate_pools = fetch_candidate_pools(MixFetcher(sp), artists)
+    return store_mix(preview_id, preview_data['playlist_name'], preview_data.get('playlist_length', preview_data['total_songs_in_playlist']),
+                     seed, artists, candidate_pools)
+
+def build_mix_around(sp, playlist_name, playlist_length, seed_artist_id, neighbor_count, max_hops, progress):
+    """Picks the seed artist's closest neighbors in the artist graph, then builds their mix like build_preview.
+
+    Each artist's share follows its graph score, so the seed gets the most tracks and farther
+    artists fewer. Once the graph knows the neighborhood this costs no Spotify calls.
+    """
+    try:
+        plan = artist_graph.expand(sp, seed_artist_id, neighbor_count, max_hops, deadline=time.monotonic() + PREVIEW_FETCH_DEADLINE_SECONDS)
+    except spotipy.SpotifyException as e:
+        if not is_rate_limited(e): raise
+        raise PreviewBuildError(SPOTIFY_RATE_LIMITED_MESSAGE)
+    percentages = apportion_quotas([score for _, score, _ in plan], 100, [100] * len(plan))
+    artist_requests = [(artist_graph.details(artist_id)['name'], artist_id, percentage)
+                       for (artist_id, _, _), percentage in zip(plan, percentages) if percentage > 0]
+    progress.add(artists_total=len(artist_requests) - (neighbor_count + 1)) # Submitted expecting a full neighborhood
+    return build_preview(sp, playlist_name, playlist_length, artist_requests, progress)
 
 @app.route("/generate_preview", methods=["POST"])
 def generate_preview_route():
     sp = get_spotify_client()
     if not sp: return redirect(url_for("login"))
     
-    user_info = session.get('user_info')
+    user_info = current_user_info()
     playlist_name = request.form.get("playlist_name", "My Artimix Playlist")
+    try:
+        playlist_length = int(request.form.get("playlist_length") or DEFAULT_PLAYLIST_LENGTH)
+    except ValueError:
+        return render_template("index.html", user_logged_in=True, user_info=user_info, error_message="Invalid playlist length.")
+    if not (0 < playlist_length <= MAX_PLAYLIST_LENGTH):
+        return render_template("index.html", user_logged_in=True, user_info=user_info, error_message=f"Playlist length must be 1-{MAX_PLAYLIST_LENGTH}.")
+    try:
+        seed = int(request.form["seed"]) if request.form.get("seed") else None
+    except ValueError:
+        return render_template("index.html", user_logged_in=True, user_info=user_info, error_message="Seed must be a whole number.")
     
-    artists_form_data = []
+    artist_requests = []
     i = 1
     while True:
         artist_query_name = request.form.get(f"artist_{i}") 
@@ -379,98 +2458,117 @@ def generate_preview_route():
             percentage = int(percentage_str)
             if not (0 < percentage <= 100):
                 return render_template("index.html", user_logged_in=True, user_info=user_info, error_message="Percentages must be 1-100.")
-            
-            artist_details = None
-            if confirmed_artist_id:
-                # print(f"DEBUG: generate_preview - Attempting to fetch artist by CONFIRMED ID: {confirmed_artist_id}")
-                artist_details = get_artist_details_by_id(sp, confirmed_artist_id)
-                if not artist_details:
-                    # print(f"DEBUG: generate_preview - FAILED to fetch by ID {confirmed_artist_id}. Falling back to search by name: {artist_query_name}")
-                    artist_details = get_artist_details_with_search(sp, artist_query_name) # Fallback
-            else:
-                # print(f"DEBUG: generate_preview - No confirmed ID. Searching by name: {artist_query_name}")
-                artist_details = get_artist_details_with_search(sp, artist_query_name)
-
-            if not artist_details: 
-                # print(f"DEBUG: generate_preview - FINAL: Could not verify artist: {artist_query_name} (ID: {confirmed_artist_id if confirmed_artist_id else 'N/A'})")
-                i += 1; continue 
-
-            # print(f"DEBUG: generate_preview - Successfully got details for artist: {artist_details['name']} (ID: {artist_details['id']})")
-            artists_form_data.append({
-                "query_name": artist_query_name, 
-                "spotify_name": artist_details['name'], 
-                "id": artist_details['id'],
-                "image_url": artist_details['image_url'], 
-                "percentage": percentage
-            })
         except ValueError:
             return render_template("index.html", user_logged_in=True, user_info=user_info, error_message="Invalid percentage.")
+        artist_requests.append((artist_query_name, confirmed_artist_id, percentage))
         i += 1
-    
-    if not artists_form_data:
+
+    if not artist_requests:
         return render_template("index.html", user_logged_in=True, user_info=user_info, error_message="Add at least one artist.")
 
-    all_prospective_playlist_tracks_details = [] 
-    artist_contributions_summary = []
-    MAX_TRACKS_PER_ARTIST_SAMPLE = 150
-
-    for artist_entry in artists_form_data:
-        artist_tracks_with_details = get_all_artist_tracks_with_details(sp, artist_entry["id"], artist_entry["spotify_name"], max_tracks_to_return=MAX_TRACKS_PER_ARTIST_SAMPLE)
-        count_for_artist = 0
-        if artist_tracks_with_details:
-            num_songs_to_pick = int(len(artist_tracks_with_details) * (artist_entry["percentage"] / 100.0))
-            if num_songs_to_pick == 0 and len(artist_tracks_with_details) > 0 and artist_entry["percentage"] > 0: num_songs_to_pick = 1
-            actual_songs_to_pick = min(num_songs_to_pick, len(artist_tracks_with_details))
-            if actual_songs_to_pick > 0 :
-                 selected_tracks_details = random.sample(artist_tracks_with_details, actual_songs_to_pick)
-                 all_prospective_playlist_tracks_details.extend(selected_tracks_details)
-                 count_for_artist = len(selected_tracks_details)
-        artist_contributions_summary.append({"name": artist_entry["spotify_name"], "image_url": artist_entry["image_url"], 
-                                             "count": count_for_artist, "requested_percentage": artist_entry["percentage"]})
-
-    if not all_prospective_playlist_tracks_details:
-        return render_template("index.html", user_logged_in=True, user_info=user_info, error_message="No tracks selected. Try different artists/percentages.")
-
-    final_unique_tracks_map = {track['uri']: track for track in all_prospective_playlist_tracks_details}
-    final_track_list_full_details = list(final_unique_tracks_map.values()); random.shuffle(final_track_list_full_details) 
-    MAX_TRACKS_FOR_PREVIEW_DETAILS = 30 
-    tracks_for_preview_display = final_track_list_full_details[:MAX_TRACKS_FOR_PREVIEW_DETAILS]
+    job_id = submit_preview_job(get_current_user_id(sp), functools.partial(build_preview, seed=seed), sp, playlist_name, playlist_length,
+                                artist_requests, artists_total=len(artist_requests))
+    if "application/json" in request.headers.get("Accept", ""):
+        return jsonify({"job_id": job_id, "status_url": url_for('preview_job_status', job_id=job_id)}), 202
+    return redirect(url_for('show_preview_job', job_id=job_id))
 
-    preview_id = str(uuid.uuid4()) 
-    preview_data_to_store = {
-        'playlist_name': playlist_name,
-        'track_uris': [track['uri'] for track in final_track_list_full_details],
-        'artist_contributions': artist_contributions_summary, 
-        'tracks_for_preview_display': tracks_for_preview_display, 
-        'total_songs_in_playlist': len(final_track_list_full_details)
-    }
-    
-    filepath = os.path.join(TEMP_PREVIEW_DIR, f"{preview_id}.json")
+@app.route("/mix_around", methods=["POST"])
+def mix_around_route():
+    sp = get_spotify_client()
+    if not sp: return redirect(url_for("login"))
+
+    wants_json = "application/json" in request.headers.get("Accept", "")
+    def fail(message):
+        if wants_json: return jsonify({"error": message}), 400
+        return render_template("index.html", user_logged_in=True, user_info=current_user_info(), error_message=message)
+
+    playlist_name = request.form.get("playlist_name") or "My Artimix Playlist"
     try:
-        with open(filepath, 'w') as f:
-            json.dump(preview_data_to_store, f, indent=4)
-    except IOError as e:
-        return render_template("index.html", user_logged_in=True, user_info=user_info, error_message="Server error: Could not save preview data.")
+        playlist_length = int(request.form.get("playlist_length") or DEFAULT_PLAYLIST_LENGTH)
+        neighbor_count = int(request.form.get("neighbors") or MIX_AROUND_DEFAULT_NEIGHBORS)
+        max_hops = int(request.form.get("hops") or 2)
+    except ValueError:
+        return fail("Playlist length, similar artists and hops must be numbers.")
+    if not (0 < playlist_length <= MAX_PLAYLIST_LENGTH): return fail(f"Playlist length must be 1-{MAX_PLAYLIST_LENGTH}.")
+    if not (0 < neighbor_count <= MIX_AROUND_MAX_NEIGHBORS): return fail(f"Similar artists must be 1-{MIX_AROUND_MAX_NEIGHBORS}.")
+    if not (0 < max_hops <= MIX_AROUND_MAX_HOPS): return fail(f"Hops must be 1-{MIX_AROUND_MAX_HOPS}.")
+
+    seed_artist_id = (request.form.get("artist_id") or "").strip()
+    is_artist_url, artist_id_from_url = parse_spotify_artist_url(seed_artist_id)
+    if is_artist_url: seed_artist_id = artist_id_from_url
+    try:
+        seed_artist = get_artist_details_by_id(sp, seed_artist_id) if seed_artist_id else None
+    except spotipy.SpotifyException:
+        return fail(SPOTIFY_RATE_LIMITED_MESSAGE)
+    if not seed_artist: return fail("Could not find that artist. Paste a Spotify artist URL or ID.")
+
+    job_id = submit_preview_job(get_current_user_id(sp), build_mix_around, sp, playlist_name, playlist_length, seed_artist['id'],
+                                neighbor_count, max_hops, artists_total=neighbor_count + 1)
+    if wants_json:
+        return jsonify({"job_id": job_id, "status_url": url_for('preview_job_status', job_id=job_id)}), 202
+    return redirect(url_for('show_preview_job', job_id=job_id))
+
+@app.route("/batch_mixes", methods=["POST"])
+def batch_mixes_route():
+    """Queues many mixes from one JSON body (see parse_mix_specs); the status URL reports progress and throughput."""
+    sp = get_spotify_client()
+    if not sp:
+        return jsonify({"error": "User not authenticated"}), 401
+    data = request.get_json(silent=True)
+    try:
+        specs = parse_mix_specs(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    batch_id = submit_mix_batch(get_current_user_id(sp), specs, create_playlists=bool(data.get('create_playlists')))
+    return jsonify({"batch_id": batch_id, "mixes": len(specs), "status_url": url_for('mix_batch_status', batch_id=batch_id)}), 202
+
+@app.route("/batch_mixes/<batch_id>")
+def mix_batch_status(batch_id):
+    sp = get_spotify_client()
+    if not sp:
+        return jsonify({"error": "User not authenticated"}), 401
+    batch = get_mix_batch(batch_id, get_current_user_id(sp))
+    if batch is None:
+        return jsonify({"error": "Batch not found"}), 404
+    for mix in batch['mixes']:
+        if mix['status'] == "done": mix["preview_url"] = url_for('show_playlist_preview', preview_id=mix["preview_id"])
+    return jsonify(batch)
 
-    return redirect(url_for('show_playlist_preview', preview_id=preview_id))
+@app.route("/preview_jobs/<job_id>")
+def show_preview_job(job_id):
+    sp = get_spotify_client(); user_info = current_user_info()
+    if not sp: return redirect(url_for("login"))
+    if get_preview_job(job_id, get_current_user_id(sp)) is None:
+        return redirect(url_for('index', error_message="Preview job not found. It may have expired."))
+    return render_template("preview_pending.html", job_id=job_id, user_logged_in=True, user_info=user_info)
+
+@app.route("/preview_jobs/<job_id>/status")
+def preview_job_status(job_id):
+    sp = get_spotify_client()
+    if not sp:
+        return jsonify({"error": "User not authenticated"}), 401
+    job = get_preview_job(job_id, get_current_user_id(sp))
+    if job is None:
+        return jsonify({"error": "Preview job not found"}), 404
+    if job["status"] == "done":
+        job["preview_url"] = url_for('show_playlist_preview', preview_id=job["preview_id"])
+    return jsonify(job)
 
 @app.route("/preview")
 def show_playlist_preview():
-    sp = get_spotify_client(); user_info = session.get('user_info')
+    sp = get_spotify_client(); user_info = current_user_info()
     if not sp: return redirect(url_for("login"))
         
     preview_id_from_url = request.args.get('preview_id')
     if not preview_id_from_url:
         return redirect(url_for('index', error_message="Preview link is invalid or expired."))
 
-    filepath = os.path.join(TEMP_PREVIEW_DIR, f"{preview_id_from_url}.json")
     try:
-        with open(filepath, 'r') as f:
-            preview_data = json.load(f)
-    except FileNotFoundError:
-        return redirect(url_for('index', error_message="Preview data not found. It may have expired or been removed."))
-    except IOError as e:
+        preview_data = preview_store.load(preview_id_from_url)
+    except sqlite3.Error as e:
         return redirect(url_for('index', error_message="Server error: Could not load preview data."))
+    if preview_data is None:
+        return redirect(url_for('index', error_message="Preview data not found. It may have expired or been removed."))
 
     return render_template(
         "preview_playlist.html",
@@ -478,34 +2576,109 @@ def show_playlist_preview():
         playlist_name=preview_data['playlist_name'],
         total_songs=preview_data['total_songs_in_playlist'],
         artist_contributions=preview_data['artist_contributions'],
-        tracks_sample_for_display=preview_data['tracks_for_preview_display'], 
+        seed=preview_data.get('seed'),
+        adjustable='artists' in preview_data and not preview_data.get('write_checkpoint'),
+        error_message=request.args.get('error_message'),
+        tracks_page_size=PREVIEW_TRACKS_PAGE_SIZE,
         user_logged_in=True, 
         user_info=user_info
     )
 
+@app.route("/preview/<preview_id>/adjust", methods=["POST"])
+def adjust_preview_route(preview_id):
+    """Changes one artist's percentage and/or re-rolls their picks, or re-rolls the whole mix, from the preview's stored pools.
+
+    Takes a form or JSON body: `artist` (0-based position in the preview), `percentage` (0-100)
+    and `reroll`. Without `artist`, `reroll` draws a new seed for every artist.
+    """
+    sp = get_spotify_client()
+    wants_json = request.is_json or "application/json" in request.headers.get("Accept", "")
+    if not sp:
+        return (jsonify({"error": "User not authenticated"}), 401) if wants_json else redirect(url_for("login"))
+    def fail(message, status=400):
+        if wants_json: return jsonify({"error": message}), status
+        return redirect(url_for('show_playlist_preview', preview_id=preview_id, error_message=message))
+
+    fields = (request.get_json(silent=True) or {}) if request.is_json else request.form
+    try:
+        artist_position = int(fields['artist']) if fields.get('artist') not in (None, "") else None
+        percentage = int(fields['percentage']) if fields.get('percentage') not in (None, "") else None
+    except (TypeError, ValueError):
+        return fail("Artist and percentage must be whole numbers.")
+    reroll = str(fields.get('reroll', "")).lower() in ("1", "true", "on")
+    if percentage is not None and (artist_position is None or not (0 <= percentage <= 100)):
+        return fail("Give the artist to change and a percentage of 0-100.")
+    if percentage is None and not reroll:
+        return fail("Nothing to adjust: give a percentage or ask for a re-roll.")
+
+    try:
+        preview_data = preview_store.load(preview_id)
+    except sqlite3.Error as e:
+        return fail("Server error: Could not load preview data.", 500)
+    if preview_data is None:
+        return fail("Preview not found. It may have expired.", 404)
+    try:
+        preview_data = adjust_preview(sp, preview_id, preview_data, artist_position, percentage, reroll)
+    except PreviewNotAdjustableError as e:
+        return fail(str(e), 409)
+    except PreviewBuildError as e:
+        return fail(str(e))
+
+    if not wants_json:
+        return redirect(url_for('show_playlist_preview', preview_id=preview_id))
+    return jsonify({"preview_id": preview_id, "seed": preview_data['seed'], "total_songs_in_playlist": preview_data['total_songs_in_playlist'],
+                    "artist_contributions": preview_data['artist_contributions'],
+                    "preview_url": url_for('show_playlist_preview', preview_id=preview_id), "tracks_url": url_for('preview_tracks', preview_id=preview_id)})
+
+@app.route("/preview/<preview_id>/tracks")
+def preview_tracks(preview_id):
+    """One page of a preview's tracklist, hydrated with display details."""
+    sp = get_spotify_client()
+    if not sp:
+        return jsonify({"error": "User not authenticated"}), 401
+    try:
+        offset = max(0, int(request.args.get("offset", 0)))
+        limit = min(max(1, int(request.args.get("limit", PREVIEW_TRACKS_PAGE_SIZE))), TRACKS_BATCH_SIZE * 2)
+    except ValueError:
+        return jsonify({"error": "offset and limit must be integers"}), 400
+    try:
+        preview_data = preview_store.load(preview_id)
+    except sqlite3.Error as e:
+        return jsonify({"error": "Could not load preview data"}), 500
+    if preview_data is None:
+        return jsonify({"error": "Preview not found"}), 404
+    track_uris = preview_data['track_uris']
+    try:
+        tracks = get_track_details_cached(sp, track_uris[offset:offset + limit])
+    except spotipy.SpotifyException as e:
+        return jsonify({"error": f"Could not load track details: {e}"}), 502
+    next_offset = offset + limit if offset + limit < len(track_uris) else None
+    return jsonify({"tracks": tracks, "offset": offset, "total": len(track_uris), "next_offset": next_offset})
+
+@app.route("/metrics")
+def metrics():
+    if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+        return Response("Unauthorized\n", status=401, mimetype="text/plain")
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
 @app.route("/confirm_add_to_spotify", methods=["POST"])
 def confirm_add_to_spotify_route():
-    sp = get_spotify_client(); user_info = session.get('user_info')
+    sp = get_spotify_client(); user_info = current_user_info()
     if not sp: return redirect(url_for("login"))
 
     preview_id_from_form = request.form.get('preview_id') 
     if not preview_id_from_form:
         return redirect(url_for("index", error_message="Missing preview identifier. Please try again."))
 
-    filepath = os.path.join(TEMP_PREVIEW_DIR, f"{preview_id_from_form}.json")
-    preview_data = None
     try:
-        with open(filepath, 'r') as f:
-            preview_data = json.load(f)
-    except FileNotFoundError:
-        return redirect(url_for("index", error_message="Playlist data to create not found. It may have expired."))
-    except IOError as e:
+        preview_data = preview_store.load(preview_id_from_form)
+    except sqlite3.Error as e:
         return redirect(url_for("index", error_message="Server error: Could not load data for playlist creation."))
+    if preview_data is None:
+        return redirect(url_for("index", error_message="Playlist data to create not found. It may have expired."))
 
-    if not preview_data or 'track_uris' not in preview_data:
-        if os.path.exists(filepath):
-            try: os.remove(filepath)
-            except OSError as e_del: print(f"DEBUG: confirm_add_to_spotify - Error deleting malformed file {filepath}: {e_del}")
+    if 'track_uris' not in preview_data:
+        preview_store.delete(preview_id_from_form)
         return redirect(url_for("index", error_message="Playlist data is incomplete. Please try again."))
 
     playlist_name = preview_data['playlist_name']
@@ -515,24 +2688,40 @@ def confirm_add_to_spotify_route():
          return render_template("playlist_created.html", error_message="No tracks were selected.", user_logged_in=True, user_info=user_info)
 
     try:
-        user_profile = sp.current_user(); user_id = user_profile['id']
+        user_id = get_current_user_id(sp)
     except Exception as e:
         return render_template("playlist_created.html", error_message=f"Could not get user info: {e}", user_logged_in=True, user_info=user_info)
 
     try:
-        new_playlist = sp.user_playlist_create(user_id, playlist_name, public=False, description="Created with Artimix!")
-        playlist_id = new_playlist['id']; playlist_url = new_playlist['external_urls']['spotify']
-        for i in range(0, len(track_uris), 100):
-            sp.playlist_add_items(playlist_id, track_uris[i:i + 100])
-        
-        if os.path.exists(filepath):
-            try: os.remove(filepath)
-            except OSError as e_del: print(f"DEBUG: confirm_add_to_spotify - Error deleting preview file {filepath} after success: {e_del}")
-        
-        return render_template("playlist_created.html", playlist_name=playlist_name, playlist_url=playlist_url, user_logged_in=True, user_info=user_info) 
+        claimed = claim_playlist_write(preview_id_from_form)
+    except sqlite3.Error as e:
+        return redirect(url_for("index", error_message="Server error: Could not load data for playlist creation."))
+    if not claimed:
+        return render_template("playlist_created.html", error_message="This playlist is already being created. Please wait a moment.",
+                               user_logged_in=True, user_info=user_info)
+    try:
+        # Reload from the database under the claim: a request on any worker that finished meanwhile
+        # has moved the checkpoint or deleted the preview, and this worker's memory copy may predate it
+        try:
+            preview_data = preview_store.load(preview_id_from_form, fresh=True)
+        except sqlite3.Error as e:
+            return redirect(url_for("index", error_message="Server error: Could not load data for playlist creation."))
+        if preview_data is None:
+            return render_template("playlist_created.html", error_message="This playlist has already been created.",
+                                   user_logged_in=True, user_info=user_info)
+        checkpoint, batch_timings = write_playlist(sp, user_id, preview_id_from_form, preview_data)
+    except PlaylistWriteError as e:
+        return render_template("playlist_created.html", error_message=str(e), batch_timings=e.batch_timings, resume_preview_id=preview_id_from_form,
+                               batches_done=e.checkpoint['batches_done'] if e.checkpoint else 0, batches_total=e.batches_total,
+                               user_logged_in=True, user_info=user_info)
+    finally:
+        release_playlist_write(preview_id_from_form)
 
-    except Exception as e:
-        return render_template("playlist_created.html", error_message=f"Playlist creation error: {e}", user_logged_in=True, user_info=user_info)
+    try: preview_store.delete(preview_id_from_form)
+    except sqlite3.Error as e_del: print(f"DEBUG: confirm_add_to_spotify - Error deleting preview {preview_id_from_form} after success: {e_del}")
+
+    return render_template("playlist_created.html", playlist_name=playlist_name, playlist_url=checkpoint['playlist_url'],
+                           batch_timings=batch_timings, user_logged_in=True, user_info=user_info)
 
 if __name__ == "__main__":
     if not all([SPOTIFY_CLIENT_ID, SPOTIFY_CLIENT_SECRET, SPOTIPY_REDIRECT_URI, app.secret_key]):